@@ -0,0 +1,52 @@
+"""Benchmarks TelegramDelivery against the fake Telegram API.
+
+Run with `python -m benchmarks.bench_delivery` from the repository root.
+"""
+import time
+
+import telebot
+
+from tg_bank_forwarder.delivery import TelegramDelivery, pack_messages
+
+from .servers import TelegramHandler, serve
+
+CHATS = 5
+MESSAGES_PER_CHAT = 10
+
+
+def run(delivery: TelegramDelivery, digest: bool):
+    TelegramHandler.messages.clear()
+    TelegramHandler.rate_limited = 0
+
+    texts = [f"<b>COMPRA {i}</b>\nUSD: {i}.00" for i in range(MESSAGES_PER_CHAT)]
+    messages = [
+        (str(chat_id), message)
+        for chat_id in range(CHATS)
+        for message, _ in pack_messages("<u>Account</u>\n\n", texts, digest=digest)
+    ]
+
+    start = time.perf_counter()
+    delivery.send(messages)
+    elapsed = time.perf_counter() - start
+
+    sent = len(TelegramHandler.messages)
+    print(
+        f"{digest=}: {sent} messages in {elapsed:.2f}s, "
+        f"{TelegramHandler.rate_limited} rate limited"
+    )
+
+
+def main():
+    server = serve(TelegramHandler)
+    telebot.apihelper.API_URL = (
+        f"http://localhost:{server.server_address[1]}/bot{{0}}/{{1}}"
+    )
+    telegram = telebot.TeleBot("123:fake", parse_mode="html")
+
+    for digest in [False, True]:
+        # Limit ourselves a bit under the server so we don't spend the whole run waiting
+        run(TelegramDelivery(telegram, workers=CHATS * 2, chat_rate=0.9), digest)
+
+
+if __name__ == "__main__":
+    main()
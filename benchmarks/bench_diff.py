@@ -0,0 +1,79 @@
+"""Benchmarks diff_transactions against the old linear matcher, and its fuzzy matching.
+
+Run with `python -m benchmarks.bench_diff` from the repository root.
+"""
+import random
+import timeit
+from datetime import datetime, timedelta
+
+from tg_bank_forwarder.diff import diff_transactions
+from tg_bank_forwarder.providers.sistarbanc import SistarbancMovement
+
+HISTORY_SIZES = [10_000, 100_000]
+# The linear matcher is quadratic, past this it takes way too long
+LINEAR_MAX_SIZE = 10_000
+
+
+def linear_diff(cached, current):
+    cached = list(cached)
+    matches, additions = [], []
+
+    for cu_t in current:
+        try:
+            matching_index = next(
+                index for index, ca_t in enumerate(cached) if ca_t.matches(cu_t)
+            )
+            cached.pop(matching_index)
+            matches.append(cu_t)
+        except StopIteration:
+            additions.append(cu_t)
+
+    return {"-": cached, "=": matches, "~": [], "+": additions}
+
+
+def make_history(size, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+
+    return [
+        SistarbancMovement(
+            card="1234",
+            ing=start + timedelta(days=rng.randrange(365)),
+            mov=start,
+            title=f"COMERCIO {rng.randrange(size // 4)}",
+            amount=rng.randrange(1, 50) * 10,  # Small range so there are duplicates
+            currency=rng.choice(["USD", "UYU"]),
+        )
+        for _ in range(size)
+    ]
+
+
+def main():
+    for size in HISTORY_SIZES:
+        cached = make_history(size)
+        # Drop some old ones and append some new ones, as a poll would
+        current = cached[size // 100 :] + make_history(size // 100, seed=1)
+
+        elapsed = timeit.timeit(lambda: diff_transactions(cached, current), number=1)
+        print(f"diff_transactions {size=}: {elapsed:.3f}s")
+
+        # Some descriptions drift, those should be modifications and not additions
+        drifted = [
+            t.model_copy(update={"title": f"{t.title} MVD"}) if i % 10 == 0 else t
+            for i, t in enumerate(current)
+        ]
+        elapsed = timeit.timeit(lambda: diff_transactions(cached, drifted), number=1)
+        diff = diff_transactions(cached, drifted)
+        counts = {kind: len(transactions) for kind, transactions in diff.items()}
+        print(f"diff_transactions drifted {size=}: {elapsed:.3f}s, {counts}")
+
+        if size <= LINEAR_MAX_SIZE:
+            exact = diff_transactions(cached, current, fuzzy=False)
+            assert linear_diff(cached, current) == exact
+
+            elapsed = timeit.timeit(lambda: linear_diff(cached, current), number=1)
+            print(f"linear_diff {size=}: {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Benchmarks check_accounts end to end, against the stand-in servers and Telegram.
+
+Run with `python -m benchmarks.bench_e2e [--sizes 100 1000] [--accounts 1 4]` from
+the repository root. Responses recorded with `benchmarks.record` are replayed when
+there are any, generated ones otherwise, repeated up to each history size.
+
+Every run is a fresh process, like a cron run, on a fresh state and cache:
+
+- cold: nothing is cached, every transaction is new and gets sent
+- unchanged: the banks answer the same as before
+- changed: about 1% of new transactions on every account
+
+Results are saved to benchmarks/results/<commit>.json, pass `--compare` with an
+older one to see how they changed.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+
+from .servers import (
+    SESSION_COOKIE,
+    SISTARBANC_AUTHORIZATIONS_HEADER,
+    SISTARBANC_MOVEMENTS_HEADER,
+    SISTARBANC_SESSION_COOKIE,
+    ItauHandler,
+    SistarbancHandler,
+    TelegramHandler,
+    make_itau_authorizations,
+    make_itau_movements,
+    make_sistarbanc_authorizations,
+    make_sistarbanc_movements,
+    make_sistarbanc_page,
+    serve,
+)
+
+RESULTS_DIR = Path("benchmarks", "results")
+
+SIZES = [100, 1_000, 10_000]
+ACCOUNT_COUNTS = [1, 4]
+PHASES = ["cold", "unchanged", "changed"]
+
+# Accounts cycle through these, each provider gets a new login every 4 accounts
+ACCOUNT_TYPES = [
+    "itau_bank_account",
+    "itau_card_authorizations",
+    "sistarbanc_movements",
+    "sistarbanc_authorizations",
+]
+SESSION_COOKIES = {"itau": SESSION_COOKIE, "sistarbanc": SISTARBANC_SESSION_COOKIE}
+
+
+def peak_rss_kb():
+    status = Path("/proc/self/status").read_text()
+    return int(re.search(r"VmHWM:\s+(\d+)", status).group(1))
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD")
+    dirty = git("status", "--porcelain", "--untracked-files=no")
+
+    return f"{commit}-dirty" if dirty else commit
+
+
+def load_rows():
+    """Rows for each account type, recorded if there are any, generated otherwise"""
+    rows = {
+        "itau_bank_account": make_itau_movements(100),
+        "itau_card_authorizations": make_itau_authorizations(100),
+        "sistarbanc_movements": make_sistarbanc_movements(100),
+        "sistarbanc_authorizations": make_sistarbanc_authorizations(100),
+    }
+
+    # Only the parent needs these, runs are measured without them
+    from tg_bank_forwarder.providers.sistarbanc import iter_table_rows
+
+    from .record import RECORDED_DIR
+
+    for path in RECORDED_DIR.glob("*.*"):
+        if path.suffix == ".json":
+            data = json.loads(path.read_text())["itaulink_msg"]["data"]
+            recorded = (
+                data["movimientosMesActual"]["movimientos"]
+                if path.stem == "itau_bank_account"
+                else data["datos"]["datosAutorizaciones"]["autorizaciones"]
+            )
+        else:
+            recorded = list(iter_table_rows(path.read_text()))
+
+        if recorded:
+            rows[path.stem] = recorded
+            print(f"Replaying {len(recorded)} recorded rows from {path}")
+
+    return rows
+
+
+def scale(rows: list, size: int) -> list:
+    return [rows[i % len(rows)] for i in range(size)]
+
+
+def set_responses(rows: dict[str, list], size: int, new=0):
+    """Makes the stand-ins answer with `size` rows, `new` of them not seen before"""
+    old = size - new
+    # Without the totals at the end
+    new_movements = make_sistarbanc_movements(new, seed=1)[:new] if new else []
+
+    ItauHandler.movements = scale(rows["itau_bank_account"], old) + make_itau_movements(
+        new, seed=1
+    )
+    ItauHandler.authorizations = scale(
+        rows["itau_card_authorizations"], old
+    ) + make_itau_authorizations(new, seed=1)
+    SistarbancHandler.movements = make_sistarbanc_page(
+        SISTARBANC_MOVEMENTS_HEADER,
+        scale(rows["sistarbanc_movements"], old) + new_movements,
+    )
+    SistarbancHandler.authorizations = make_sistarbanc_page(
+        SISTARBANC_AUTHORIZATIONS_HEADER,
+        scale(rows["sistarbanc_authorizations"], old)
+        + make_sistarbanc_authorizations(new, seed=1),
+    )
+
+
+def write_config(workdir: Path, count: int, itau, sistarbanc):
+    accounts = {}
+    for i in range(count):
+        account_type = ACCOUNT_TYPES[i % len(ACCOUNT_TYPES)]
+        provider = account_type.split("_")[0]
+
+        accounts[f"Account {i}"] = {
+            "type": account_type,
+            "credentials_env": f"BENCH_{provider.upper()}_{i // len(ACCOUNT_TYPES)}",
+            "id": str(i),
+        }
+
+    config = {
+        "token": "1:benchmark",
+        "target_chat": "42",
+        # Each transaction on its own message would only benchmark the fake Telegram
+        "digest": True,
+        "providers": {
+            "itau": {
+                "http_fetch": True,
+                "base_url": f"http://localhost:{itau.server_address[1]}/trx/",
+            },
+            "sistarbanc": {
+                "base_url": f"http://localhost:{sistarbanc.server_address[1]}/",
+            },
+        },
+        "accounts": accounts,
+    }
+
+    (workdir / "config.yml").write_text(yaml.safe_dump(config, allow_unicode=True))
+
+
+def run(telegram_port: int):
+    """Runs check_accounts once on the current directory, prints how it went as JSON"""
+    import telebot
+
+    from tg_bank_forwarder.bot import TGBankForwarderBot
+    from tg_bank_forwarder.delivery import TelegramDelivery
+    from tg_bank_forwarder.session_store import SessionStore
+
+    telebot.apihelper.API_URL = f"http://localhost:{telegram_port}/bot{{0}}/{{1}}"
+
+    start = time.perf_counter()
+    bot = TGBankForwarderBot("config.yml")
+    bot.delivery = TelegramDelivery(bot.telegram, chat_rate=1000, global_rate=1000)
+
+    # Already logged in, logging in to Itau needs a browser
+    for session in bot.plan:
+        store = SessionStore(session.credentials_env)
+        if store.load() is None:
+            name, value = SESSION_COOKIES[session.provider].split("=")
+            cookie = {"name": name, "value": value, "domain": "localhost.local"}
+            store.save({"cookies": [{**cookie, "path": "/"}], "origins": []})
+
+    bot.check_accounts()
+
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "peak_rss_mb": peak_rss_kb() / 1024}))
+
+
+def measure(workdir: Path, telegram_port: int) -> dict:
+    sent = len(TelegramHandler.messages)
+
+    output = subprocess.run(
+        [sys.executable, "-m", __spec__.name, "--run", str(telegram_port)],
+        cwd=workdir,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    return {
+        **json.loads(output.splitlines()[-1]),
+        "messages": len(TelegramHandler.messages) - sent,
+    }
+
+
+def describe(result: dict) -> str:
+    return f"{result['size']:>7} x {result['accounts']:>2} {result['phase']:>9}"
+
+
+def compare(results: list[dict], baseline: dict):
+    previous = {(r["size"], r["accounts"], r["phase"]): r for r in baseline["results"]}
+
+    print(f"\nCompared to {baseline['commit']}:")
+    for result in results:
+        before = previous.get((result["size"], result["accounts"], result["phase"]))
+        if not before:
+            continue
+
+        changes = ", ".join(
+            f"{metric} {(result[metric] - before[metric]) / before[metric]:+.1%}"
+            for metric in ("seconds", "peak_rss_mb")
+        )
+        print(f"{describe(result)}: {changes}")
+
+
+def main(sizes, account_counts, baseline_path=None):
+    rows = load_rows()
+    # Read before running, it might be the same file the results are saved to
+    baseline = json.loads(Path(baseline_path).read_text()) if baseline_path else None
+
+    itau = serve(ItauHandler)
+    sistarbanc = serve(SistarbancHandler)
+    telegram = serve(TelegramHandler)
+    # Above what the runs send at, so the fake Telegram never rate limits them
+    TelegramHandler.chat_rate = 10_000
+    TelegramHandler.latency = 0
+
+    results = []
+    for size in sizes:
+        for accounts in account_counts:
+            with tempfile.TemporaryDirectory() as workdir:
+                write_config(Path(workdir), accounts, itau, sistarbanc)
+
+                for phase in PHASES:
+                    new = size // 100 if phase == "changed" else 0
+                    set_responses(rows, size, new)
+
+                    result = {"size": size, "accounts": accounts, "phase": phase}
+                    result |= measure(Path(workdir), telegram.server_address[1])
+                    result["throughput"] = size * accounts / result["seconds"]
+                    results.append(result)
+
+                    print(
+                        f"{describe(result)}: {result['seconds']:.3f}s, "
+                        f"{result['throughput']:,.0f} transactions/s, "
+                        f"{result['peak_rss_mb']:.1f}MB peak RSS, "
+                        f"{result['messages']} messages"
+                    )
+
+    commit = git_commit()
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = RESULTS_DIR / f"{commit}.json"
+    path.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "results": results,
+            },
+            indent=4,
+        )
+    )
+    print(f"Saved to {path}")
+
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--accounts", type=int, nargs="+", default=ACCOUNT_COUNTS)
+    parser.add_argument("--compare", help="Results of an older run to compare with")
+    parser.add_argument("--run", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run)
+    else:
+        main(args.sizes, args.accounts, args.compare)
@@ -0,0 +1,79 @@
+"""Benchmarks loading, diffing and storing the cache as records instead of models.
+
+Run with `python -m benchmarks.bench_records` from the repository root.
+"""
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from pydantic import TypeAdapter
+from pydantic_core import to_jsonable_python
+
+from tg_bank_forwarder.diff import diff_transactions
+from tg_bank_forwarder.providers.sistarbanc import SistarbancMovement
+from tg_bank_forwarder.records import TransactionRecord, record_encoder
+
+from .bench_diff import make_history
+
+SIZE = 10_000
+
+movements_adapter = TypeAdapter(list[SistarbancMovement])
+
+
+def models_cycle(raw: str, current, timings):
+    with timed(timings, "load"):
+        cached = movements_adapter.validate_json(raw)
+    with timed(timings, "diff"):
+        diff = diff_transactions(cached, current)
+    with timed(timings, "store"):
+        json.dumps(current, indent=4, default=to_jsonable_python)
+    return diff
+
+
+def records_cycle(raw: str, current, timings):
+    with timed(timings, "load"):
+        cached = [TransactionRecord(SistarbancMovement, d) for d in json.loads(raw)]
+    with timed(timings, "diff"):
+        # Scraped models are converted here, the one place they're validated is the scrape
+        current = [TransactionRecord.from_model(t) for t in current]
+        diff = diff_transactions(cached, current)
+    with timed(timings, "store"):
+        json.dumps(current, indent=4, default=record_encoder)
+    return diff
+
+
+@contextmanager
+def timed(timings: dict, phase: str):
+    start = time.perf_counter()
+    yield
+    timings[phase] = time.perf_counter() - start
+
+
+def measure(name, cycle, raw, current):
+    timings: dict[str, float] = {}
+    diff = cycle(raw, current, timings)
+
+    # Measured apart, tracemalloc slows everything down
+    tracemalloc.start()
+    cycle(raw, current, {})
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    counts = {kind: len(transactions) for kind, transactions in diff.items()}
+    phases = ", ".join(f"{phase} {elapsed:.3f}s" for phase, elapsed in timings.items())
+    print(f"{name:>8}: {phases}, {peak / 2**20:.1f}MB peak, {counts}")
+
+
+def main():
+    history = make_history(SIZE)
+    raw = json.dumps(history, default=to_jsonable_python)
+    # What a poll would scrape, some old ones gone and some new ones
+    current = history[SIZE // 100 :] + make_history(SIZE // 100, seed=1)
+
+    measure("models", models_cycle, raw, current)
+    measure("records", records_cycle, raw, current)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Benchmarks rendering notifications with compiled templates against format().
+
+Run with `python -m benchmarks.bench_render` from the repository root. Every
+account type renders SIZE transactions, as records the way they're queued, and
+then gets packed into digests. The old format() methods, which validated a model
+and concatenated strings for each transaction, are kept here to compare with.
+"""
+import time
+
+from pydantic import TypeAdapter
+
+from tg_bank_forwarder.config import Config
+from tg_bank_forwarder.delivery import (
+    DIGEST_SEPARATOR,
+    TELEGRAM_MESSAGE_LIMIT,
+    pack_messages,
+)
+from tg_bank_forwarder.providers.itau import (
+    ItauAccountTransaction,
+    ItauCardAuthorization,
+)
+from tg_bank_forwarder.providers.sistarbanc import (
+    DATE_FORMAT,
+    DATETIME_FORMAT,
+    SistarbancAuthorization,
+    SistarbancMovement,
+)
+from tg_bank_forwarder.records import TransactionRecord
+from tg_bank_forwarder.templates import render_header, render_transactions
+
+from .servers import (
+    make_itau_authorizations,
+    make_itau_movements,
+    make_sistarbanc_authorizations,
+    make_sistarbanc_movements,
+)
+
+SIZE = 100_000
+
+
+def legacy_itau_account_transaction(self):
+    text = f"<b>{self.tipo} {self.descripcion} {self.descripcionAdicional}</b>\n"
+    text += "\n"
+    text += f"<b>Fecha:</b> {self.fecha}\n"
+    text += "\n"
+    text += f"<b>Importe:</b> {self.importe}\n"
+    return text
+
+
+def legacy_itau_card_authorization(self):
+    text = f"<b>{self.tipo} {self.nombreComercio}: {self.etiqueta}</b>\n"
+    text += "\n"
+    text += f"<b>Fecha:</b> {self.fecha} {self.hora}\n"
+    text += "\n"
+    text += f"<b>{self.moneda}:</b> {self.importe}\n"
+
+    return text
+
+
+def legacy_sistarbanc_authorization(self):
+    installments = (
+        f"{self.instalments[0]}/{self.instalments[1]}"
+        if self.instalments[1] > 1
+        else None
+    )
+    text = f"<b>{self.title} {installments}</b>\n"
+    text += f"Date: {self.date.strftime(DATETIME_FORMAT)}\n"
+    text += "\n"
+    text += "\n"
+    text += f"<b>{self.currency}: {self.amount}</b>"
+
+    return text
+
+
+def legacy_sistarbanc_movement(self):
+    text = f"<b>{self.title}</b>\n"
+    text += f"Mov: {self.mov.strftime(DATE_FORMAT)}\n"
+    text += f"Ing: {self.ing.strftime(DATE_FORMAT)}\n"
+    text += "\n"
+    text += "\n"
+    text += f"<b>{self.currency}: {self.amount}</b>"
+
+    return text
+
+
+def legacy_pack_messages(header, texts, digest=False):
+    messages = []
+
+    for index, text in enumerate(texts):
+        if digest and messages:
+            message, indexes = messages[-1]
+            candidate = message + DIGEST_SEPARATOR + text
+
+            if len(candidate) <= TELEGRAM_MESSAGE_LIMIT:
+                messages[-1] = (candidate, indexes + [index])
+                continue
+
+        messages.append((header + text, [index]))
+
+    return messages
+
+
+def make_models():
+    """Models and their legacy format by account type, SIZE of each"""
+    # Without the totals at the end
+    sistarbanc_movements = make_sistarbanc_movements(SIZE)[:SIZE]
+
+    return {
+        "itau_bank_account": (
+            TypeAdapter(list[ItauAccountTransaction]).validate_python(
+                make_itau_movements(SIZE)
+            ),
+            legacy_itau_account_transaction,
+        ),
+        "itau_card_authorizations": (
+            TypeAdapter(list[ItauCardAuthorization]).validate_python(
+                make_itau_authorizations(SIZE)
+            ),
+            legacy_itau_card_authorization,
+        ),
+        "sistarbanc_movements": (
+            [SistarbancMovement.parse_raw(row) for row in sistarbanc_movements],
+            legacy_sistarbanc_movement,
+        ),
+        "sistarbanc_authorizations": (
+            [
+                SistarbancAuthorization.parse_raw(row)
+                for row in make_sistarbanc_authorizations(SIZE)
+            ],
+            legacy_sistarbanc_authorization,
+        ),
+    }
+
+
+def make_account(account_type: str):
+    config = Config(
+        token="1:benchmark",
+        target_chat="42",
+        accounts={
+            account_type: {
+                "type": account_type,
+                "credentials_env": "BENCH",
+                "id": "1",
+            }
+        },
+    )
+    return config.accounts[0]
+
+
+def main():
+    for account_type, (models, legacy_format) in make_models().items():
+        account = make_account(account_type)
+        # Queued transactions may come from a worker, without a model
+        records = [
+            TransactionRecord(type(m), TransactionRecord.from_model(m).data)
+            for m in models
+        ]
+
+        start = time.perf_counter()
+        legacy_header = f"<u>{account.name}</u>\n" + "\n"
+        # The models had to be built back from the records before formatting them
+        legacy_texts = [
+            legacy_format(r.model_class.model_validate(r.data)) for r in records
+        ]
+        legacy_pack_messages(legacy_header, legacy_texts, True)
+        legacy_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        texts = render_transactions(account, records)
+        rendered = time.perf_counter() - start
+        messages = pack_messages(render_header(account), texts, True)
+        elapsed = time.perf_counter() - start
+
+        # Same as before, but for the installments format() got wrong
+        if account_type != "sistarbanc_authorizations":
+            assert texts == legacy_texts, account_type
+        assert messages == legacy_pack_messages(render_header(account), texts, True)
+
+        print(
+            f"{account_type:>26}: {len(records):,} transactions, "
+            f"{legacy_elapsed:.3f}s with format(), {elapsed:.3f}s with templates "
+            f"({rendered:.3f}s rendering), {len(messages):,} digests"
+        )
+
+
+if __name__ == "__main__":
+    main()
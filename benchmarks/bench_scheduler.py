@@ -0,0 +1,111 @@
+"""Simulates adaptive polling against polling on a fixed interval.
+
+Run with `python -m benchmarks.bench_scheduler [--days 28]` from the repository root.
+New transactions arrive at random, mostly during the day, on accounts ranging from
+busy card authorizations to a nearly idle bank account. Reported for each policy:
+how many times the banks were polled, and how long new transactions waited to be
+noticed, on average and at worst.
+"""
+import argparse
+import random
+import statistics
+from datetime import datetime
+from types import SimpleNamespace
+
+from tg_bank_forwarder.adaptive import AdaptivePolicy, ChangeRates, LoginBudget
+
+FIXED_INTERVAL = 30 * 60
+MIN_INTERVAL = 5 * 60
+LATENCY_SLO = 60 * 60
+
+# New transactions per hour during the day, nights get a twentieth of it
+ACCOUNT_RATES = {
+    "authorizations": 3.0,
+    "card": 1.0,
+    "bank": 0.2,
+    "savings": 0.02,
+}
+DAY_HOURS = range(9, 22)
+
+
+def make_arrivals(rate: float, start: float, end: float, rng: random.Random):
+    """Arrivals at the day rate, nights thinned out to a twentieth of them"""
+    arrivals = []
+    t = start + rng.expovariate(rate / 3600)
+    while t < end:
+        if datetime.fromtimestamp(t).hour in DAY_HOURS or rng.random() < 1 / 20:
+            arrivals.append(t)
+        t += rng.expovariate(rate / 3600)
+
+    return arrivals
+
+
+def simulate(arrivals: list[float], start: float, end: float, next_interval):
+    """Polls from start to end, returns how many polls and each arrival's wait"""
+    polls, waits = 0, []
+    pending = iter(arrivals)
+    arrival = next(pending, None)
+    t = start
+
+    while t < end:
+        polls += 1
+        changes = 0
+        while arrival is not None and arrival <= t:
+            waits.append(t - arrival)
+            changes += 1
+            arrival = next(pending, None)
+
+        t += next_interval(t, changes)
+
+    return polls, waits
+
+
+def adaptive_interval(name: str):
+    """Next interval for a session with just the account, learning as it goes"""
+    session = SimpleNamespace(
+        accounts=[SimpleNamespace(qualified_name=name, latency_slo=None)]
+    )
+    policy = AdaptivePolicy(
+        ChangeRates(path=None), LoginBudget(None), MIN_INTERVAL, LATENCY_SLO
+    )
+
+    def next_interval(t: float, changes: int) -> float:
+        policy.rates.observe(name, changes, now=t)
+        return policy.interval(session, now=t)
+
+    return next_interval
+
+
+def main(days: int):
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1).timestamp()
+    end = start + days * 24 * 60 * 60
+
+    results = {"fixed": [0, []], "adaptive": [0, []]}
+
+    for name, rate in ACCOUNT_RATES.items():
+        arrivals = make_arrivals(rate, start, end, rng)
+
+        polls, waits = simulate(arrivals, start, end, lambda t, changes: FIXED_INTERVAL)
+        results["fixed"][0] += polls
+        results["fixed"][1] += waits
+
+        polls, waits = simulate(arrivals, start, end, adaptive_interval(name))
+        results["adaptive"][0] += polls
+        results["adaptive"][1] += waits
+
+    print(f"{days} days, {len(ACCOUNT_RATES)} accounts:")
+    for policy_name, (polls, waits) in results.items():
+        print(
+            f"{policy_name:>9}: {polls:>6} polls, {len(waits)} transactions waited "
+            f"{statistics.mean(waits) / 60:.1f} min on average, "
+            f"{max(waits) / 60:.1f} min at worst"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=28)
+    args = parser.parse_args()
+
+    main(args.days)
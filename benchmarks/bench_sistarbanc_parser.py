@@ -0,0 +1,152 @@
+"""Benchmarks the streaming Sistarbanc table parser against the BeautifulSoup one it replaced.
+
+Run with `python -m benchmarks.bench_sistarbanc_parser [page.html...]` from the
+repository root, without pages it uses generated ones. The bot doesn't depend on
+beautifulsoup4 anymore, without it only the streaming parser is checked and measured.
+"""
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+from tg_bank_forwarder.providers.sistarbanc import iter_table_rows
+
+from .servers import (
+    SISTARBANC_AUTHORIZATIONS_HEADER,
+    SISTARBANC_MOVEMENTS_HEADER,
+    make_sistarbanc_authorizations,
+    make_sistarbanc_movements,
+    make_sistarbanc_page,
+)
+
+FIXTURES_DIR = Path("benchmarks", "fixtures")
+ROWS = 5000
+
+
+def bs4_table_rows(html):
+    bs = BeautifulSoup(html, "lxml")
+
+    content = bs.select_one(".maq_contenido.cuenta")
+    assert content, "Missing content"
+
+    table = content.select_one("#listado table")
+
+    if not table:
+        return []
+
+    output = []
+    for trs in table.select("tr"):
+        output.append([td.text.strip() for td in trs.select("td")])
+
+    return [dict(zip(output[0], raw)) for raw in output[1:]]
+
+
+def streaming_table_rows(html):
+    return list(iter_table_rows(html))
+
+
+PARSERS = {"streaming": streaming_table_rows}
+if BeautifulSoup:
+    PARSERS = {"bs4": bs4_table_rows, **PARSERS}
+
+
+def edge_case_page(listado, after=""):
+    return f"""<html><body>
+<div class="maq_contenido cuenta">
+<div id="listado">{listado}</div>
+{after}
+</div>
+</body></html>"""
+
+
+LATER_TABLE = "<table><tr><td>Concepto</td></tr><tr><td>Not a row</td></tr></table>"
+
+# Pages the generated ones don't cover, and what the BeautifulSoup parser got from them
+EDGE_CASES = [
+    (edge_case_page(""), []),
+    (edge_case_page("", LATER_TABLE), []),
+    (
+        edge_case_page(
+            "<table><tr><td>Concepto</td></tr><tr><td> A </td></tr></table>",
+            LATER_TABLE,
+        ),
+        [{"Concepto": "A"}],
+    ),
+]
+
+
+def generated_pages():
+    FIXTURES_DIR.mkdir(parents=True, exist_ok=True)
+
+    pages = {
+        "movements": make_sistarbanc_page(
+            SISTARBANC_MOVEMENTS_HEADER, make_sistarbanc_movements(ROWS)
+        ),
+        "authorizations": make_sistarbanc_page(
+            SISTARBANC_AUTHORIZATIONS_HEADER, make_sistarbanc_authorizations(ROWS)
+        ),
+    }
+
+    paths = []
+    for name, html in pages.items():
+        path = FIXTURES_DIR / f"sistarbanc_{name}_{ROWS}.html"
+        path.write_text(html)
+        paths.append(path)
+
+    return paths
+
+
+def peak_rss_kb():
+    # ru_maxrss survives exec, the high water mark on /proc doesn't
+    status = Path("/proc/self/status").read_text()
+    return int(re.search(r"VmHWM:\s+(\d+)", status).group(1))
+
+
+def measure(parser, path):
+    """Runs on its own process so peak RSS only accounts for this parser"""
+    html = Path(path).read_text()
+    baseline = peak_rss_kb()
+
+    start = time.perf_counter()
+    PARSERS[parser](html)
+    elapsed = time.perf_counter() - start
+
+    peak = peak_rss_kb() - baseline
+    print(
+        f"{parser:>10} {Path(path).name}: {elapsed:.3f}s, +{peak / 1024:.1f}MB peak RSS"
+    )
+
+
+def check_edge_cases():
+    for html, expected in EDGE_CASES:
+        for parser in PARSERS.values():
+            assert parser(html) == expected, f"{parser.__name__} differs on {html}"
+
+
+def main(paths):
+    check_edge_cases()
+    paths = paths or generated_pages()
+
+    for path in paths:
+        html = Path(path).read_text()
+        if BeautifulSoup:
+            assert bs4_table_rows(html) == streaming_table_rows(html), f"{path} differs"
+
+        for parser in PARSERS:
+            subprocess.run(
+                [sys.executable, "-m", __spec__.name, "--measure", parser, str(path)],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(*sys.argv[2:4])
+    else:
+        main(sys.argv[1:])
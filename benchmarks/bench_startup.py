@@ -0,0 +1,61 @@
+"""Fails when importing the bot takes longer than the budget, or pulls modules it shouldn't.
+
+Run with `python -m benchmarks.bench_startup` from the repository root.
+"""
+import re
+import statistics
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = 750
+RUNS = 5
+
+# Only the providers that are actually used should import these
+LAZY_MODULES = ["playwright", "lxml"]
+
+
+def import_time_ms(module: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # import time: self [us] | cumulative | imported package
+    times = re.findall(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)", result.stderr)
+    return next(int(us) for us, name in times if name == module) / 1000
+
+
+def eagerly_imported(module: str) -> list[str]:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    loaded = {name.split(".")[0] for name in result.stdout.split()}
+    return [name for name in LAZY_MODULES if name in loaded]
+
+
+def main():
+    module = "tg_bank_forwarder.bot"
+
+    elapsed = statistics.median(import_time_ms(module) for _ in range(RUNS))
+    print(f"import {module}: {elapsed:.0f}ms (budget {IMPORT_BUDGET_MS}ms)")
+
+    eager = eagerly_imported(module)
+    if eager:
+        print(f"{module} eagerly imports {', '.join(eager)}")
+
+    if elapsed > IMPORT_BUDGET_MS or eager:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
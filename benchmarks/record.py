@@ -0,0 +1,161 @@
+"""Records sanitized responses from the real banks, for the stand-in servers to replay.
+
+Run with `python -m benchmarks.record [config.yml]` from the repository root. It logs
+in with the credentials of the configured accounts and fetches every account type
+once. Only sanitized copies are written, to benchmarks/fixtures/recorded/, which is
+never committed:
+
+- Merchants and descriptions are replaced by placeholders, equal values get equal
+  placeholders so duplicated transactions stay duplicated.
+- Card numbers, balances and reference numbers are replaced.
+- Fields and columns the models don't use are left out, they could hold anything.
+- Sistarbanc pages are rebuilt around the table, the rest of the real page has the
+  holder's name on it.
+
+Dates and amounts are kept as they are.
+"""
+import json
+import sys
+from pathlib import Path
+
+from tg_bank_forwarder.config import Config
+from tg_bank_forwarder.planner import build_plan
+from tg_bank_forwarder.providers.itau import (
+    ItauAccountTransaction,
+    ItauCardAuthorization,
+)
+from tg_bank_forwarder.providers.registry import provider_registry
+from tg_bank_forwarder.providers.sistarbanc import SKIPPED_MOVEMENTS, iter_table_rows
+
+from .servers import (
+    SISTARBANC_AUTHORIZATIONS_HEADER,
+    SISTARBANC_MOVEMENTS_HEADER,
+    make_sistarbanc_page,
+)
+
+RECORDED_DIR = Path("benchmarks", "fixtures", "recorded")
+
+
+class Pseudonyms:
+    """Replaces each distinct value with a placeholder, the same one every time"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.names: dict[str, str] = {}
+
+    def __call__(self, value: str) -> str:
+        if value not in self.names:
+            self.names[value] = f"{self.prefix} {len(self.names) + 1}"
+
+        return self.names[value]
+
+
+def known_fields(model, data: dict) -> dict:
+    """Only the fields the model has, as Itau sent them"""
+    return {name: data[name] for name in model.model_fields if name in data}
+
+
+def sanitize_itau_bank_account(data: dict) -> dict:
+    descriptions = Pseudonyms("COMPRA")
+    movements = [
+        {
+            **known_fields(ItauAccountTransaction, movement),
+            "descripcion": descriptions(movement["descripcion"]),
+            "descripcionAdicional": "",
+            "saldo": 0.0,
+        }
+        for movement in data["movimientosMesActual"]["movimientos"]
+    ]
+
+    return {"movimientosMesActual": {"movimientos": movements}}
+
+
+def sanitize_itau_card_authorizations(data: dict) -> dict:
+    merchants = Pseudonyms("COMERCIO")
+    authorizations = [
+        {
+            **known_fields(ItauCardAuthorization, authorization),
+            "nombreComercio": merchants(authorization["nombreComercio"]),
+            "tarjeta": {"hash": "0000"},
+            "nroReserva": str(i),
+        }
+        for i, authorization in enumerate(
+            data["datos"]["datosAutorizaciones"]["autorizaciones"]
+        )
+    ]
+
+    return {"datos": {"datosAutorizaciones": {"autorizaciones": authorizations}}}
+
+
+def sanitize_sistarbanc_rows(html: str, header: list[str]) -> str:
+    merchants = Pseudonyms("COMERCIO")
+    rows = []
+
+    for i, row in enumerate(iter_table_rows(html)):
+        # Columns we don't know about could hold anything, they're left out
+        row = {**{cell: row.get(cell, "") for cell in header}, "Tarjeta": "0000"}
+
+        if row["Concepto"] not in SKIPPED_MOVEMENTS:
+            row["Concepto"] = merchants(row["Concepto"])
+        if "Autorización" in row:
+            row["Autorización"] = str(100_000 + i)
+
+        rows.append(row)
+
+    return make_sistarbanc_page(header, rows)
+
+
+def sanitize_sistarbanc_movements(html: str) -> str:
+    return sanitize_sistarbanc_rows(html, SISTARBANC_MOVEMENTS_HEADER)
+
+
+def sanitize_sistarbanc_authorizations(html: str) -> str:
+    return sanitize_sistarbanc_rows(html, SISTARBANC_AUTHORIZATIONS_HEADER)
+
+
+def record_itau(provider, account):
+    data = provider.with_session(provider._fetch, provider.endpoint_for(account))
+    data = globals()[f"sanitize_{account.type}"](data)
+
+    return ".json", json.dumps({"itaulink_msg": {"data": data}}, indent=4)
+
+
+def record_sistarbanc(provider, account):
+    html = provider.with_session(provider._get, provider.endpoint_for(account)).text
+
+    return ".html", globals()[f"sanitize_{account.type}"](html)
+
+
+RECORDERS = {"itau": record_itau, "sistarbanc": record_sistarbanc}
+
+
+def main(config_path="config.yml"):
+    config = Config.read_config(config_path)
+    RECORDED_DIR.mkdir(parents=True, exist_ok=True)
+    recorded = set()
+
+    for session in build_plan(config.accounts):
+        accounts = [a for a in session.accounts if a.type not in recorded]
+        if not accounts:
+            continue
+
+        provider_class = provider_registry[session.provider]
+        provider_options = config.providers.get(session.provider, {})
+
+        with provider_class(
+            session.credentials_env, tenant=session.tenant, **provider_options
+        ) as provider:
+            for account in accounts:
+                if account.type in recorded:
+                    continue
+
+                suffix, content = RECORDERS[session.provider](provider, account)
+                path = RECORDED_DIR / f"{account.type}{suffix}"
+                path.write_text(content)
+                recorded.add(account.type)
+
+                print(f"Recorded {account.name} to {path}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
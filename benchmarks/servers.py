@@ -0,0 +1,337 @@
+"""Local stand-ins for the bank websites and Telegram, so everything can run offline.
+
+Run with `python -m benchmarks.servers` from the repository root and point the
+provider's base_url at it in config.yml:
+
+    providers:
+      itau:
+        base_url: http://localhost:8001/trx/
+        http_fetch: true
+      sistarbanc:
+        base_url: http://localhost:8003/
+"""
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SESSION_COOKIE = "JSESSIONID=stand-in"
+SISTARBANC_SESSION_COOKIE = "PHPSESSID=stand-in"
+
+ITAU_LOGIN_PAGE = b"""<html><body>
+<form method="post" action="/trx/login">
+    <input id="documento" name="documento">
+    <input id="pass" name="pass" type="password">
+    <button id="vprocesar" type="submit">Ingresar</button>
+</form>
+</body></html>"""
+
+
+def to_millis(d: datetime):
+    return {"millis": int(d.timestamp() * 1000)}
+
+
+def make_itau_movements(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1, 3)  # Itau dates are midnight in Uruguay
+
+    return [
+        {
+            "tipo": rng.choice(["D", "C"]),
+            "fecha": to_millis(start + timedelta(days=i % 28)),
+            "descripcion": f"COMPRA {rng.randrange(1000)}",
+            "importe": rng.randrange(1, 10_000) / 100,
+            "descripcionAdicional": "",
+            "codigoFormulario": 0,
+            "saldo": 0.0,
+        }
+        for i in range(count)
+    ]
+
+
+def make_itau_authorizations(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1, 3)
+
+    return [
+        {
+            "tipo": "COMPRA",
+            "fecha": to_millis(start + timedelta(days=i % 28)),
+            "tarjeta": {"hash": "1234"},
+            "importe": rng.randrange(1, 10_000) / 100,
+            "nombreComercio": f"COMERCIO {rng.randrange(1000)}",
+            "moneda": rng.choice(["Dolares", "Pesos"]),
+            "hora": "12:00",
+            "nroReserva": str(i),
+            "nroRespuesta": 0,
+            "etiqueta": "Aprobada",
+            "aprobada": True,
+        }
+        for i in range(count)
+    ]
+
+
+SISTARBANC_MOVEMENTS_HEADER = ["Tarjeta", "Mov.", "Ing.", "Concepto", "$", "USD"]
+SISTARBANC_AUTHORIZATIONS_HEADER = [
+    "Autorización",
+    "Fecha",
+    "Hora",
+    "Tarjeta",
+    "Concepto",
+    "Nro. Cuota",
+    "Cant. Cuotas",
+    "$",
+    "USD",
+]
+
+
+SISTARBANC_LOGIN_PAGE = """<html><body>
+<form method="post" action="/ingresar/">
+    <input name="email_acc">
+    <input name="clave_acc" type="password">
+    <input name="btn_ingresar" type="submit" value="Ingresar">
+</form>
+</body></html>"""
+
+
+def make_sistarbanc_page(header, rows):
+    cells = "".join(f"<td>{cell}</td>" for cell in header)
+    trs = [f"<tr class='titulo'>{cells}</tr>"]
+    for row in rows:
+        cells = "".join(f"<td>\n  {row[cell]} </td>" for cell in header)
+        trs.append(f"<tr>{cells}</tr>")
+
+    return f"""<html><head><title>e-Sistarbanc</title></head><body>
+<div class="menu"><a href="/">Inicio</a></div>
+<div class="maq_contenido cuenta">
+<h2>Tarjeta</h2>
+<div id="listado"><table>{"".join(trs)}</table></div>
+</div>
+</body></html>"""
+
+
+def make_sistarbanc_movements(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+
+    rows = []
+    for i in range(count):
+        amount = f"{rng.randrange(1, 100_000) / 100:.2f}".replace(".", ",")
+        usd = rng.random() < 0.3
+        rows.append(
+            {
+                "Tarjeta": "1234",
+                "Mov.": (start + timedelta(days=i % 28)).strftime("%d/%m/%y"),
+                "Ing.": (start + timedelta(days=i % 28 + 1)).strftime("%d/%m/%y"),
+                "Concepto": f"COMERCIO {rng.randrange(1000)}",
+                "$": "0,00" if usd else amount,
+                "USD": amount if usd else "0,00",
+            }
+        )
+
+    rows.append({**rows[-1], "Concepto": "TOTAL TARJETA"})
+    rows.append({**rows[-1], "Concepto": "SALDO AL ULTIMO CORTE"})
+    return rows
+
+
+def make_sistarbanc_authorizations(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+
+    rows = []
+    for i in range(count):
+        amount = f"{rng.randrange(1, 100_000) / 100:.2f}".replace(".", ",")
+        usd = rng.random() < 0.3
+        date = start + timedelta(days=i % 28, seconds=i)
+        rows.append(
+            {
+                "Autorización": str(100_000 + i),
+                "Fecha": date.strftime("%d/%m/%y"),
+                "Hora": date.strftime("%H:%M:%S"),
+                "Tarjeta": "1234",
+                "Concepto": f"COMERCIO {rng.randrange(1000)}",
+                "Nro. Cuota": "1",
+                "Cant. Cuotas": rng.choice(["1", "1", "3"]),
+                "$": "0,00" if usd else amount,
+                "USD": amount if usd else "0,00",
+            }
+        )
+
+    return rows
+
+
+class ItauHandler(BaseHTTPRequestHandler):
+    movements: list[dict] = make_itau_movements(50)
+    authorizations: list[dict] = make_itau_authorizations(20)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body: bytes, content_type="text/html", headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_data(self, data):
+        body = json.dumps({"itaulink_msg": {"data": data}}).encode("latin-1")
+        self.send_body(body, "application/json")
+
+    def do_POST(self):
+        if self.path == "/trx/login":
+            self.send_response(302)
+            self.send_header("Set-Cookie", f"{SESSION_COOKIE}; Path=/")
+            self.send_header("Location", "/trx/")
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if SESSION_COOKIE not in self.headers.get("Cookie", ""):
+            return self.send_body(ITAU_LOGIN_PAGE)
+
+        if re.fullmatch(r"/trx/cuentas/1/\w+/mesActual", self.path):
+            self.send_data({"movimientosMesActual": {"movimientos": self.movements}})
+        elif re.fullmatch(r"/trx/tarjetas/credito/\w+/autorizaciones_\w+", self.path):
+            self.send_data(
+                {
+                    "datos": {
+                        "datosAutorizaciones": {"autorizaciones": self.authorizations}
+                    }
+                }
+            )
+        else:
+            self.send_body(b"<html>Itau</html>")
+
+
+class SistarbancHandler(BaseHTTPRequestHandler):
+    movements: str = make_sistarbanc_page(
+        SISTARBANC_MOVEMENTS_HEADER, make_sistarbanc_movements(50)
+    )
+    authorizations: str = make_sistarbanc_page(
+        SISTARBANC_AUTHORIZATIONS_HEADER, make_sistarbanc_authorizations(20)
+    )
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_page(self, html: str):
+        body = html.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path == "/ingresar/":
+            self.send_response(302)
+            self.send_header("Set-Cookie", f"{SISTARBANC_SESSION_COOKIE}; Path=/")
+            self.send_header("Location", "/")
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if SISTARBANC_SESSION_COOKIE not in self.headers.get("Cookie", ""):
+            return self.send_page(SISTARBANC_LOGIN_PAGE)
+
+        if self.path == "/ac_movimientos_actuales.php":
+            self.send_page(self.movements)
+        elif self.path == "/ac_autorizaciones_pendientes.php":
+            self.send_page(self.authorizations)
+        else:
+            self.send_page("<html>e-Sistarbanc</html>")
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+    """Fake Bot API, answers 429 when a chat gets more than chat_rate messages per second
+
+    Point telebot at it with:
+
+        telebot.apihelper.API_URL = "http://localhost:8002/bot{0}/{1}"
+    """
+
+    chat_rate = 1.0
+    latency = 0.05
+
+    lock = threading.Lock()
+    last_message: dict[str, float] = {}
+    messages: list[dict] = []
+    rate_limited = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        params = parse_qs(url.query) | parse_qs(self.rfile.read(length).decode())
+        params = {k: v[0] for k, v in params.items()}
+
+        if not url.path.endswith("/sendMessage"):
+            return self.send_json(404, {"ok": False, "error_code": 404})
+
+        time.sleep(self.latency)
+        chat_id = params["chat_id"]
+
+        with self.lock:
+            now = time.monotonic()
+            too_soon = now - self.last_message.get(chat_id, 0) < 1 / self.chat_rate
+            if too_soon:
+                TelegramHandler.rate_limited += 1
+            else:
+                self.last_message[chat_id] = now
+                self.messages.append(params)
+
+        if too_soon:
+            return self.send_json(
+                429,
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                },
+            )
+
+        self.send_json(
+            200,
+            {
+                "ok": True,
+                "result": {
+                    "message_id": len(self.messages),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": params.get("text", ""),
+                },
+            },
+        )
+
+
+def serve(handler, port=0):
+    """Starts the server on a background thread, port 0 picks a free one"""
+    server = ThreadingHTTPServer(("localhost", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    serve(TelegramHandler, 8002)
+    serve(SistarbancHandler, 8003)
+    ThreadingHTTPServer(("localhost", 8001), ItauHandler).serve_forever()
@@ -1,3 +1,4 @@
+import argparse
 import logging
 from os import getenv
 
@@ -5,9 +6,13 @@ import sentry_sdk
 from dotenv import load_dotenv
 
 from tg_bank_forwarder.bot import TGBankForwarderBot
+from tg_bank_forwarder.config import Config
+from tg_bank_forwarder.planner import build_plan, describe_plan
 
 load_dotenv()
 SENTRY_DSN = getenv("SENTRY_DSN")
+# Tracing every run adds overhead to the hot path, sample a fraction of them instead
+SENTRY_TRACES_SAMPLE_RATE = float(getenv("SENTRY_TRACES_SAMPLE_RATE", "0"))
 LOGLEVEL = getenv("LOGLEVEL", "INFO").upper()
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=LOGLEVEL
@@ -16,13 +21,35 @@ logging.basicConfig(
 if SENTRY_DSN:
     sentry_sdk.init(
         dsn=SENTRY_DSN,
-        traces_sample_rate=1.0,
+        traces_sample_rate=SENTRY_TRACES_SAMPLE_RATE,
     )
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and check the accounts on their configured interval",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the sessions and endpoints that would be fetched, without fetching",
+    )
+    args = parser.parse_args()
+
+    if args.dry_run:
+        config = Config.read_config("config.yml")
+        print(describe_plan(build_plan(config.accounts)))
+        return
+
     bot = TGBankForwarderBot("config.yml")
-    bot.check_accounts()
+
+    if args.daemon:
+        bot.loop()
+    else:
+        bot.check_accounts()
 
 
 if __name__ == "__main__":
@@ -3,8 +3,10 @@ from dotenv import load_dotenv
 from tg_bank_forwarder.bot import TGBankForwarderBot
 
 load_dotenv()
-bot = TGBankForwarderBot("config.yml")
-# inspect(bot.check_accounts())
-# bot.loop()
 
-bot.check_accounts()
+# Workers are spawned and import this module again, they must not start the bot
+if __name__ == "__main__":
+    bot = TGBankForwarderBot("config.yml")
+    # inspect(bot.check_accounts())
+
+    bot.loop()
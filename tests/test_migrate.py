@@ -0,0 +1,76 @@
+import pytest
+import yaml
+
+from tg_bank_forwarder import migrate
+from tg_bank_forwarder.config import Config
+from tg_bank_forwarder.records import TransactionRecord
+from tg_bank_forwarder.transaction_cache import SQLiteStorage
+
+CONFIG = {
+    "token": "1:test",
+    "target_chat": "42",
+    "accounts": {
+        "VISA": {
+            "type": "itau_card_authorizations",
+            "credentials_env": "ITAU",
+            "id": "1",
+        }
+    },
+}
+
+COFFEE = {
+    "tipo": "COMPRA",
+    "fecha": "2024-03-01",
+    "tarjeta": "1234",
+    "importe": 120.0,
+    "nombreComercio": "CAFE",
+    "moneda": "Pesos",
+    "hora": "09:00",
+    "nroReserva": "1",
+    "nroRespuesta": 0,
+    "etiqueta": "Aprobada",
+    "aprobada": True,
+}
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "config.yml"
+    path.write_text(yaml.safe_dump(CONFIG))
+    return path
+
+
+def count(storage, table):
+    return storage.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_rerun_keeps_diffs_of_empty_accounts(config_path):
+    migrate.main(config_path)
+
+    # Nothing was pending on the JSON cache, the bot found something since
+    account = Config(**CONFIG).accounts[0]
+    storage = SQLiteStorage()
+    record = TransactionRecord(account.transaction_model, COFFEE)
+    storage.store_diff(account, {"-": [], "~": [], "+": [record]})
+
+    migrate.main(config_path)
+
+    assert count(SQLiteStorage(), "diffs") == 1
+
+
+def test_interrupted_account_is_migrated_again(config_path, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("Interrupted")
+
+    monkeypatch.setattr(SQLiteStorage, "store", fail)
+    with pytest.raises(RuntimeError):
+        migrate.main(config_path)
+
+    storage = SQLiteStorage()
+    assert count(storage, "migrations") == 0
+
+    monkeypatch.undo()
+    migrate.main(config_path)
+
+    assert count(SQLiteStorage(), "migrations") == 1
@@ -0,0 +1,113 @@
+from telebot.apihelper import ApiTelegramException
+
+from tg_bank_forwarder.config import Config
+from tg_bank_forwarder.delivery import is_permanent_error
+from tg_bank_forwarder.diff import diff_transactions
+from tg_bank_forwarder.outbox import Outbox
+from tg_bank_forwarder.providers.itau import ItauCardAuthorization
+from tg_bank_forwarder.records import TransactionRecord
+
+COFFEE = {
+    "tipo": "COMPRA",
+    "fecha": "2024-03-01",
+    "tarjeta": "1234",
+    "importe": 120.0,
+    "nombreComercio": "CAFE",
+    "moneda": "Pesos",
+    "hora": "09:00",
+    "nroReserva": "1",
+    "nroRespuesta": 0,
+    "etiqueta": "Aprobada",
+    "aprobada": True,
+}
+
+
+def make_account():
+    config = Config(
+        token="1:test",
+        target_chat="42",
+        accounts={
+            "VISA": {
+                "type": "itau_card_authorizations",
+                "credentials_env": "ITAU",
+                "id": "1",
+            }
+        },
+    )
+    return config.accounts[0]
+
+
+def poll(outbox, account, cached, current):
+    """Queues what's new like the bot does, returns what's pending afterwards"""
+    diff = diff_transactions(cached, current)
+    outbox.queue_transactions("42", account, diff["+"], diff["="] + diff["~"])
+
+    pending = outbox.pending()
+    outbox.mark_sent([id for id, *_ in pending])
+
+    return pending
+
+
+def test_repeated_purchase_across_polls(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    account = make_account()
+    coffee = TransactionRecord(ItauCardAuthorization, COFFEE)
+
+    assert len(poll(outbox, account, [], [coffee])) == 1
+    # The same coffee again, the first one is still there
+    assert len(poll(outbox, account, [coffee], [coffee, coffee])) == 1
+
+
+def test_requeued_diff_is_not_sent_twice(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    account = make_account()
+    coffee = TransactionRecord(ItauCardAuthorization, COFFEE)
+
+    assert len(poll(outbox, account, [], [coffee, coffee])) == 2
+    # Like a run that failed before updating the cache, and was retried
+    assert len(poll(outbox, account, [], [coffee, coffee])) == 0
+
+
+def test_same_purchase_after_the_first_left(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    account = make_account()
+    coffee = TransactionRecord(ItauCardAuthorization, COFFEE)
+    later = TransactionRecord(
+        ItauCardAuthorization, {**COFFEE, "hora": "15:30", "nroReserva": "2"}
+    )
+
+    assert len(poll(outbox, account, [], [coffee])) == 1
+    # The first one is no longer pending
+    assert len(poll(outbox, account, [coffee], [])) == 0
+    assert len(poll(outbox, account, [], [later])) == 1
+
+
+def test_rejected_messages_are_not_retried(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    account = make_account()
+    coffee = TransactionRecord(ItauCardAuthorization, COFFEE)
+    outbox.queue_transactions("42", account, [coffee])
+
+    ids = [id for id, *_ in outbox.pending()]
+    outbox.mark_failed(ids, 0, TimeoutError())
+    outbox.db.execute("UPDATE outbox SET next_attempt_at = 0")
+    assert len(outbox.pending()) == 1
+
+    outbox.mark_rejected(ids, ValueError("Bad Request: can't parse entities"))
+    assert outbox.pending() == []
+    # Still deduplicates
+    outbox.queue_transactions("42", account, [coffee])
+    assert outbox.pending() == []
+
+
+def test_only_telegram_rejections_are_permanent():
+    def telegram_error(code):
+        return ApiTelegramException(
+            "sendMessage", None, {"error_code": code, "description": ""}
+        )
+
+    assert is_permanent_error(telegram_error(400))
+    assert is_permanent_error(telegram_error(403))
+    assert not is_permanent_error(telegram_error(429))
+    assert not is_permanent_error(telegram_error(502))
+    assert not is_permanent_error(ConnectionError())
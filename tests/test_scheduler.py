@@ -0,0 +1,24 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tg_bank_forwarder.scheduler import Scheduler
+
+
+def test_stalled_job_does_not_hold_back_the_others():
+    executor = ThreadPoolExecutor(2)
+    scheduler = Scheduler(executor)
+    released = threading.Event()
+    runs = []
+
+    scheduler.every(0.01, released.wait, name="stalled")
+    scheduler.every(0.01, lambda: runs.append(1), name="fast")
+
+    def stop():
+        scheduler.stop()
+        released.set()
+
+    threading.Timer(0.5, stop).start()
+    scheduler.run()
+    executor.shutdown()
+
+    assert len(runs) > 5
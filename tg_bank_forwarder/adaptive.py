@@ -0,0 +1,180 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .session_store import SessionStore
+
+if TYPE_CHECKING:
+    from .config import Account
+    from .planner import Session
+
+logger = logging.getLogger(__name__)
+
+CHANGE_RATES_PATH = Path("state", "change_rates.json")
+
+# New transactions per hour assumed for an account until it's learned
+PRIOR_RATE = 0.2
+# How much each check moves the learned rate of the hours it covered
+LEARNING_RATE = 0.2
+# Poll once this many new transactions are expected to be waiting
+CHANGES_PER_POLL = 0.5
+
+
+def hour_of_day(timestamp: float) -> int:
+    return time.localtime(timestamp).tm_hour
+
+
+class ChangeRates:
+    """Learns how many new transactions per hour each account gets, by hour of the day
+
+    Every check is a sample of how many new transactions showed up since the
+    previous one, spread over the hours of the day it covered.
+    """
+
+    def __init__(self, path: Path | None = CHANGE_RATES_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # Qualified account name -> rates for each hour of the day, and last check
+        self.state: dict[str, dict] = {}
+
+        if path:
+            try:
+                with open(path) as f:
+                    self.state = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+    def rate(self, account_name: str, at: float) -> float:
+        """Expected new transactions per hour"""
+        rates = self.state.get(account_name, {}).get("rates")
+        return rates[hour_of_day(at)] if rates else PRIOR_RATE
+
+    def observe(self, account_name: str, changes: int, now: float | None = None):
+        now = now or time.time()
+
+        with self.lock:
+            account = self.state.setdefault(
+                account_name, {"rates": [PRIOR_RATE] * 24, "last_check": None}
+            )
+            since, account["last_check"] = account["last_check"], now
+
+            # Only a day is considered, anything longer was downtime anyway
+            if since is None or now <= since:
+                return
+            since = max(since, now - 24 * 60 * 60)
+
+            sample = changes / ((now - since) / 3600)
+            start = since
+            while start < now:
+                end = min(now, (start // 3600 + 1) * 3600)
+                weight = LEARNING_RATE * (end - start) / 3600
+                rates = account["rates"]
+                hour = hour_of_day(start)
+                rates[hour] += weight * (sample - rates[hour])
+                start = end
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            tmp_path.replace(self.path)
+
+
+class LoginBudget:
+    """Logins done over the last hour, across every provider and tenant"""
+
+    def __init__(self, max_per_hour: int | None):
+        self.max_per_hour = max_per_hour
+        self.lock = threading.Lock()
+        self.logins: deque[float] = deque()
+
+    def _expire(self, now: float):
+        while self.logins and self.logins[0] <= now - 3600:
+            self.logins.popleft()
+
+    def record(self, now: float | None = None):
+        with self.lock:
+            self.logins.append(now or time.time())
+
+    def wait_time(self, now: float | None = None) -> float:
+        """Seconds until there's a login left, 0 if there's one now"""
+        if self.max_per_hour is None:
+            return 0
+
+        now = now or time.time()
+        with self.lock:
+            self._expire(now)
+            if len(self.logins) < self.max_per_hour:
+                return 0
+
+            # Without any logins allowed, sessions are only used while they last
+            return self.logins[0] + 3600 - now if self.logins else 3600
+
+
+class AdaptivePolicy:
+    """Decides when each session is polled next, from its accounts' change rates
+
+    Busy accounts are polled as soon as about CHANGES_PER_POLL new transactions
+    are expected, quiet ones back off up to their latency SLO, which is never
+    exceeded unless there are no logins left for the hour.
+    """
+
+    def __init__(
+        self,
+        rates: ChangeRates,
+        logins: LoginBudget,
+        min_interval: float,
+        latency_slo: float,
+    ):
+        self.rates = rates
+        self.logins = logins
+        self.min_interval = min_interval
+        self.latency_slo = latency_slo
+        # Sessions that had to log in on their last check, they'll likely do again
+        self.needed_login: set[str] = set()
+
+    def slo(self, account: "Account") -> float:
+        return account.latency_slo or self.latency_slo
+
+    def interval(self, session: "Session", now: float | None = None) -> float:
+        now = now or time.time()
+        slo = min(self.slo(account) for account in session.accounts)
+
+        rate = sum(
+            self.rates.rate(account.qualified_name, now) for account in session.accounts
+        )
+        interval = CHANGES_PER_POLL / rate * 3600 if rate > 0 else slo
+
+        return max(self.min_interval, min(interval, slo))
+
+    def postpone(self, session: "Session") -> float:
+        """Seconds to wait before checking the session, only if it'd need a login"""
+        wait = self.logins.wait_time()
+        if not wait:
+            return 0
+
+        saved = SessionStore(session.credentials_env, session.tenant).load() is not None
+        if saved and session.name not in self.needed_login:
+            return 0
+
+        logger.info(f"No logins left for {session.name}, postponed {wait:.0f}s")
+        return wait
+
+    def checked(self, account: "Account", diff: dict | None):
+        self.rates.observe(account.qualified_name, len(diff["+"]) if diff else 0)
+
+    def record_login(self, session: "Session", logged_in: bool):
+        if logged_in:
+            self.logins.record()
+            self.needed_login.add(session.name)
+        else:
+            self.needed_login.discard(session.name)
@@ -1,52 +1,244 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import groupby
+from threading import Lock
 
 import sentry_sdk
 import telebot
 from rich import print
 
-from tg_bank_forwarder.transaction_cache import commit_cache_changes
+from tg_bank_forwarder.transaction_cache import (
+    commit_cache_changes,
+    configure_commits,
+    configure_storage,
+)
 
+from .adaptive import AdaptivePolicy, ChangeRates, LoginBudget
+from .browser import close_browser_pools, configure_browser_pool
 from .config import Config
+from .delivery import TelegramDelivery, is_permanent_error, pack_messages
+from .events import configure_events, serve_events
+from .metrics import metrics
+from .outbox import Outbox
+from .planner import Session, build_plan
 from .providers.registry import provider_registry
+from .retention import configure_retention
+from .scheduler import Scheduler
+from .templates import configure_templates
+from .workers import WorkerLimits, WorkerSettings, check_in_worker
 
 
 class TGBankForwarderBot:
     def __init__(self, config_path):
         self.config = Config.read_config(config_path)
+        configure_storage(self.config.cache_backend)
+        configure_commits(self.config.commit_interval)
+        configure_retention(self.config.retention)
+        configure_templates(self.config.templates, self.config.header_template)
+        configure_events(self.config.event_log)
         self.telegram = telebot.TeleBot(self.config.token, parse_mode="html")
+        self.delivery = TelegramDelivery(self.telegram)
+        self.outbox = Outbox()
+        self.tenants = {tenant.name: tenant for tenant in self.config.tenants}
+        self.sending_lock = Lock()
 
-    def grouped_accounts(self):
-        """Groups accounts so if the provider and the credentials are the same, we reuse the session"""
-        return groupby(self.config.accounts, lambda a: (a.provider, a.credentials_env))
+        configure_browser_pool(
+            self.config.browser_max_uses, self.config.browser_max_rss_mb
+        )
+        # Kept around so the worker threads, and their warm browsers, are reused
+        self.executor = ThreadPoolExecutor(self.config.concurrency)
+        # Accounts sharing tenant, provider and credentials are checked on one session
+        self.plan = build_plan(self.config.accounts)
+        self.worker_limits = WorkerLimits(
+            self.config.worker_timeout,
+            self.config.worker_max_rss_mb,
+            self.config.worker_retries,
+        )
+        # Workers are spawned from scratch, they configure themselves with these
+        self.worker_settings = WorkerSettings(
+            self.config.browser_max_uses,
+            self.config.browser_max_rss_mb,
+            self.config.retention,
+            self.config.templates,
+            self.config.header_template,
+        )
 
     @commit_cache_changes()
     def check_accounts(self):
-        for (provider_name, credentials_env), accounts in self.grouped_accounts():
-            print(f"{provider_name=}")
+        try:
+            # check_group handles its own errors
+            unchanged = sum(self.executor.map(self.check_group, self.plan))
+        finally:
+            close_browser_pools(self.executor, self.config.concurrency)
 
-            try:
-                with provider_registry[provider_name](credentials_env) as provider:
-                    for account in accounts:
-                        print(f"{account=}")
+        print(
+            f"Checked {len(self.config.accounts)} accounts, {unchanged} skipped as unchanged"
+        )
 
-                        new_transactions = provider.get_new_transactions(account)
+        if self.config.metrics_textfile:
+            metrics.write_textfile(self.config.metrics_textfile)
 
-                        self.send_transactions(account, new_transactions)
+    def check_group(self, session: Session, policy: AdaptivePolicy | None = None):
+        """Returns how many accounts were skipped because they didn't change"""
+        print(f"{session.name=}")
+        unchanged = 0
 
-            except Exception as err:
-                print(err)
+        try:
+            if self.config.isolated_workers:
+                unchanged = check_in_worker(
+                    session,
+                    self.config.providers.get(session.provider, {}),
+                    self.worker_limits,
+                    self.worker_settings,
+                    self.queue_transactions,
+                    policy,
+                )
+            else:
+                unchanged = self.check_in_process(session, policy)
+
+        except Exception as err:
+            print(err)
+            with sentry_sdk.push_scope() as scope:
+                scope.set_tag("tenant", session.tenant)
                 sentry_sdk.capture_exception(err)
-                self.send_error(err)
+            self.send_error(session.tenant, err)
+
+        self.send_pending()
+
+        return unchanged
+
+    def check_in_process(self, session: Session, policy: AdaptivePolicy | None = None):
+        provider_class = provider_registry[session.provider]
+        provider_options = self.config.providers.get(session.provider, {})
+        provider = provider_class(
+            session.credentials_env, tenant=session.tenant, **provider_options
+        )
+        unchanged = 0
+
+        try:
+            with provider:
+                for account in session.accounts:
+                    print(f"{account=}")
+
+                    diff = provider.compare_transactions(
+                        account, self.queue_transactions
+                    )
+                    if diff is None:
+                        unchanged += 1
+
+                    if policy:
+                        policy.checked(account, diff)
+        finally:
+            if policy:
+                policy.record_login(session, provider.logged_in)
+
+        return unchanged
+
+    def poll(self, session: Session, policy: AdaptivePolicy | None = None):
+        """Daemon job for the session, returns how long to wait when it can't log in yet"""
+        if policy:
+            wait = policy.postpone(session)
+            if wait:
+                return wait
+
+        self.check_group(session, policy)
+
+        if policy:
+            policy.rates.save()
+
+    def loop(self):
+        """Keeps checking every account group on its own interval until SIGTERM"""
+        scheduler = Scheduler(self.executor)
+        scheduler.install_signal_handlers()
+
+        if self.config.metrics_port is not None:
+            metrics.serve(self.config.metrics_port)
+
+        if self.config.event_log_port is not None:
+            serve_events(self.config.event_log_port)
 
-    def send_error(self, err: Exception):
+        policy = None
+        if self.config.adaptive_polling:
+            policy = AdaptivePolicy(
+                ChangeRates(),
+                LoginBudget(self.config.max_logins_per_hour),
+                self.config.min_interval,
+                self.config.latency_slo,
+            )
+
+        for session in self.plan:
+            if policy:
+                interval = partial(policy.interval, session)
+            else:
+                interval = min(
+                    a.interval or self.config.interval for a in session.accounts
+                )
+
+            scheduler.every(
+                interval,
+                commit_cache_changes()(partial(self.poll, session, policy)),
+                jitter=self.config.jitter,
+                name=session.name,
+            )
+
+        try:
+            scheduler.run()
+        finally:
+            close_browser_pools(self.executor, self.config.concurrency)
+            self.executor.shutdown()
+
+    def send_error(self, tenant: str, err: Exception):
+        """Errors only go to the tenant they happened to"""
         text = f"Error:\n{str(err)}"
-        self.telegram.send_message(self.config.target_chat, text, parse_mode="")
+        chat_id = self.tenants[tenant].target_chat
+        self.telegram.send_message(chat_id, text, parse_mode="")
+
+    def queue_transactions(self, account, diff):
+        """Queues the new transactions, before the cache gets updated"""
+        chat_id = self.tenants[account.tenant].target_chat
+        self.outbox.queue_transactions(
+            chat_id, account, diff["+"], diff["="] + diff["~"]
+        )
+
+    def send_pending(self):
+        """Delivers whatever is due on the outbox, failures are retried later with a backoff
+
+        Messages Telegram rejects, like bad HTML from a template, aren't retried.
+        """
+        # Only one thread drains the outbox at a time, so nothing is sent twice
+        with self.sending_lock:
+            rows = self.outbox.pending()
+            batches = []
 
-    def send_transactions(self, account, new_transactions):
-        for transaction in new_transactions:
-            text = f"<u>{account.name}</u>\n"
-            text += "\n"
-            text += transaction.format()
+            for (chat_id, header), group in groupby(rows, lambda r: (r[1], r[2])):
+                group = list(group)
+                texts = [text for _, _, _, text, _ in group]
 
-            self.telegram.send_message(self.config.target_chat, text)
+                packed = pack_messages(header, texts, self.config.digest)
+
+                for message, indexes in packed:
+                    batches.append((chat_id, message, [group[i] for i in indexes]))
+
+            with metrics.timer("telegram_send"):
+                errors = self.delivery.send(
+                    [(chat_id, text) for chat_id, text, _ in batches]
+                )
+
+            for (_, _, batch_rows), err in zip(batches, errors):
+                ids = [id for id, *_ in batch_rows]
+
+                if not err:
+                    metrics.inc("messages", status="sent")
+                    self.outbox.mark_sent(ids)
+                    continue
+
+                print(err)
+                sentry_sdk.capture_exception(err)
 
+                if is_permanent_error(err):
+                    metrics.inc("messages", status="rejected")
+                    self.outbox.mark_rejected(ids, err)
+                else:
+                    metrics.inc("messages", status="failed")
+                    attempts = max(attempts for *_, attempts in batch_rows)
+                    self.outbox.mark_failed(ids, attempts, err)
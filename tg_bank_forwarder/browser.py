@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from playwright.sync_api import Browser, BrowserContext, Playwright
+
+logger = logging.getLogger(__name__)
+
+# Defaults for every pool, see configure_browser_pool
+pool_options = {"max_uses": 20, "max_rss_mb": None}
+
+# Playwright's sync API is bound to the thread that started it, so each thread gets its own pool
+_local = threading.local()
+
+# Every thread's pool, so they can all be closed when shutting down
+_pools: set["BrowserPool"] = set()
+_pools_lock = threading.Lock()
+
+# How long executor threads wait for each other to close their pools, in seconds
+CLOSE_TIMEOUT = 30
+
+
+def configure_browser_pool(max_uses: int = 20, max_rss_mb: int | None = None):
+    pool_options.update(max_uses=max_uses, max_rss_mb=max_rss_mb)
+
+
+def get_browser_pool() -> "BrowserPool":
+    if not hasattr(_local, "pool"):
+        _local.pool = BrowserPool(**pool_options)
+        with _pools_lock:
+            _pools.add(_local.pool)
+
+    return _local.pool
+
+
+def close_browser_pool():
+    """Closes the pool of the current thread, if it has one"""
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        return
+
+    pool.close()
+    del _local.pool
+    with _pools_lock:
+        _pools.discard(pool)
+
+
+def close_browser_pools(executor: Executor | None = None, threads: int = 1):
+    """Closes the pools of this thread and of the `threads` threads of the executor
+
+    Playwright can only be stopped from the thread that started it, so each
+    thread of the executor gets a task closing its own pool, which waits for the
+    others so no thread takes two.
+    """
+    if executor and _pools:
+        barrier = threading.Barrier(threads)
+
+        def close_on_thread(_):
+            try:
+                barrier.wait(CLOSE_TIMEOUT)
+            except threading.BrokenBarrierError:
+                pass  # Some thread was busy, the rest still close theirs
+            close_browser_pool()
+
+        list(executor.map(close_on_thread, range(threads)))
+
+    close_browser_pool()
+
+    if _pools:
+        logger.warning(f"Couldn't close {len(_pools)} browser pools")
+
+
+def process_tree_rss(pid: int, include_self=False) -> int:
+    """Resident memory in bytes of every process started by pid, Linux only"""
+    children: dict[int, list[int]] = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The process name might contain spaces, so split after it
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+
+    rss, pending = 0, [pid] if include_self else list(children.get(pid, []))
+    while pending:
+        child = pending.pop()
+        pending.extend(children.get(child, []))
+        try:
+            pages = int(Path("/proc", str(child), "statm").read_text().split()[1])
+        except OSError:
+            continue
+        rss += pages * os.sysconf("SC_PAGE_SIZE")
+
+    return rss
+
+
+class BrowserPool:
+    """Keeps a Chromium instance warm and hands out an isolated context per session
+
+    The browser is relaunched after max_uses contexts or once it goes over
+    max_rss_mb, but only when none of its contexts are open.
+    """
+
+    def __init__(self, max_uses: int = 20, max_rss_mb: int | None = None):
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+
+        self.playwright: "Playwright | None" = None
+        self.browser: "Browser | None" = None
+        self.uses = 0
+
+    def _needs_recycle(self):
+        assert self.browser
+
+        if self.browser.contexts:
+            return False
+
+        if self.uses >= self.max_uses:
+            return True
+
+        if self.max_rss_mb and os.path.isdir("/proc"):
+            rss_mb = process_tree_rss(os.getpid()) / 2**20
+            logger.debug(f"Browser processes are using {rss_mb:.0f}MB")
+            return rss_mb > self.max_rss_mb
+
+        return False
+
+    def _launch(self):
+        # Playwright is heavy to import, only do it when a browser is needed
+        from playwright.sync_api import sync_playwright
+
+        start = time.perf_counter()
+
+        if not self.playwright:
+            self.playwright = sync_playwright().start()
+        self.browser = self.playwright.chromium.launch()
+        self.uses = 0
+
+        logger.info(f"Launched Chromium in {time.perf_counter() - start:.2f}s")
+
+    def new_context(self, **kwargs) -> "BrowserContext":
+        if self.browser and self._needs_recycle():
+            logger.info(f"Recycling Chromium after {self.uses} uses")
+            self.browser.close()
+            self.browser = None
+
+        if not self.browser:
+            self._launch()
+
+        assert self.browser
+        start = time.perf_counter()
+        context = self.browser.new_context(**kwargs)
+        self.uses += 1
+
+        logger.info(f"Created browser context in {time.perf_counter() - start:.2f}s")
+        return context
+
+    def close(self):
+        if self.playwright:
+            self.playwright.stop()
+
+        self.playwright = None
+        self.browser = None
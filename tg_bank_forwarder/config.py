@@ -1,37 +1,67 @@
-from typing import Annotated, Literal, Optional, Union
+from typing import TYPE_CHECKING, Annotated, ClassVar, Literal, Optional, Union
 
 import yaml
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 
-from .providers.itau import ItauAccountTransaction, ItauCardAuthorization
-from .providers.sistarbanc import SistarbancAuthorization, SistarbancMovement
+from .providers.registry import transaction_model_registry
+from .templates import DEFAULT_HEADER_TEMPLATE, check_template
+
+if TYPE_CHECKING:
+    from .providers.base import BaseTransaction
 
 
 class BaseAccount(BaseModel):
+    # YAML reads ids and chats as numbers, pydantic v1 took them as strings
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
     type: str
     name: str
     credentials_env: str
+    # Seconds between checks when running as a daemon, overrides Config.interval
+    interval: Optional[int] = None
+    # Seconds a new transaction can wait to be noticed, overrides Config.latency_slo
+    latency_slo: Optional[int] = None
+    # Notification template, overrides Config.templates, see templates.py
+    template: Optional[str] = None
+    # Set from the tenant the account is configured on
+    tenant: str = ""
+
+    provider: ClassVar[str]
+
+    @model_validator(mode="after")
+    def check_account_template(self):
+        if self.template:
+            model = self.transaction_model
+            check_template(self.template, model, model.template_extras)
+
+        return self
+
+    @property
+    def qualified_name(self) -> str:
+        """Unique across tenants, the cache, fetch state and outbox go by it"""
+        return f"{self.tenant}/{self.name}" if self.tenant else self.name
+
+    @property
+    def transaction_model(self) -> type["BaseTransaction"]:
+        return transaction_model_registry[self.type]
 
 
 class SistarbancMovementsAccount(BaseAccount):
     provider = "sistarbanc"
-    transaction_model = SistarbancMovement
 
     type: Literal["sistarbanc_movements"]
-    card_number: Optional[str]
+    card_number: Optional[str] = None
 
 
 class SistarbancAuthorizationsAccount(BaseAccount):
     provider = "sistarbanc"
-    transaction_model = SistarbancAuthorization
 
     type: Literal["sistarbanc_authorizations"]
-    card_number: Optional[str]
+    card_number: Optional[str] = None
 
 
 class ItauBankAccount(BaseAccount):
     provider = "itau"
-    transaction_model = ItauAccountTransaction
 
     type: Literal["itau_bank_account"]
     id: str
@@ -39,10 +69,9 @@ class ItauBankAccount(BaseAccount):
 
 class ItauCardAuthorizationsAccount(BaseAccount):
     provider = "itau"
-    transaction_model = ItauCardAuthorization
 
     type: Literal["itau_card_authorizations"]
-    card_number: Optional[str]
+    card_number: Optional[str] = None
     id: str
 
 
@@ -57,14 +86,132 @@ Account = Annotated[
 ]
 
 
-class Config(BaseModel):
-    token: str
+class Tenant(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    # Empty for the accounts configured at the top level, which are cached like before
+    name: str = Field("", pattern=r"^(|\w[\w.-]*)$")
     target_chat: str
     accounts: list[Account]
 
-    @validator("accounts", pre=True)
-    def transform_accounts(cls, value: dict[str, dict]) -> list[dict]:
-        return [{"name": k, **v} for k, v in value.items()]
+    @model_validator(mode="before")
+    @classmethod
+    def transform_accounts(cls, data: dict) -> dict:
+        tenant = data.get("name", "")
+        accounts = data.get("accounts", {})
+
+        return {
+            **data,
+            "accounts": [
+                {"name": k, **v, "tenant": tenant} for k, v in accounts.items()
+            ],
+        }
+
+
+class Config(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    token: str
+
+    # Every tenant gets its own chat and accounts, the top level target_chat and
+    # accounts are a tenant of their own
+    tenants: list[Tenant]
+
+    # Where transactions are cached, see transaction_cache.storage_backends
+    cache_backend: Literal["json", "sqlite"] = "json"
+
+    # Commit the cache at most every this many seconds
+    commit_interval: int = 0
+
+    # Days of history kept on the cache by account type, older ones are archived
+    retention: dict[str, int] = {}
+
+    # Pack several transactions on each Telegram message
+    digest: bool = False
+
+    # Notification templates by account type, and of the header on each message,
+    # which is rendered with the account
+    templates: dict[str, str] = {}
+    header_template: str = DEFAULT_HEADER_TEMPLATE
+
+    # Extra keyword arguments for each provider, by provider name
+    providers: dict[str, dict] = {}
+
+    # The browser is relaunched after this many sessions, or when it uses more memory than this
+    browser_max_uses: int = 20
+    browser_max_rss_mb: Optional[int] = None
+
+    # How many provider groups can be checked at the same time
+    concurrency: int = 1
+
+    # Scrape each provider group on its own process, which is killed and retried when
+    # it takes longer than worker_timeout seconds or uses more than worker_max_rss_mb
+    isolated_workers: bool = False
+    worker_timeout: int = 300
+    worker_max_rss_mb: Optional[int] = None
+    worker_retries: int = 1
+
+    # Only used when running as a daemon
+    interval: int = 30 * 60
+    jitter: int = 60
+
+    # Instead of on interval, poll each group as often as its accounts get new
+    # transactions, learned as it runs, between min_interval and the latency SLO
+    adaptive_polling: bool = False
+    min_interval: int = 5 * 60
+    latency_slo: int = 60 * 60
+    # Checks that would need to log in wait while these many were done in the last hour
+    max_logins_per_hour: Optional[int] = None
+
+    # OpenMetrics output, written to a file after each run, or served over HTTP as a daemon
+    metrics_textfile: Optional[str] = None
+    metrics_port: Optional[int] = None
+
+    # Log every change found to state/events, see events.py, and serve it over HTTP
+    # long polling as a daemon
+    event_log: bool = False
+    event_log_port: Optional[int] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def transform_tenants(cls, data: dict) -> dict:
+        data = dict(data)
+        tenants = [{"name": k, **v} for k, v in data.pop("tenants", {}).items()]
+
+        if "accounts" in data or not tenants:
+            tenants.insert(
+                0,
+                {
+                    "target_chat": data.pop("target_chat", None),
+                    "accounts": data.pop("accounts", {}),
+                },
+            )
+
+        return {**data, "tenants": tenants}
+
+    @field_validator("templates")
+    @classmethod
+    def check_templates(cls, templates: dict[str, str]) -> dict[str, str]:
+        for account_type, template in templates.items():
+            if account_type not in transaction_model_registry:
+                raise ValueError(f"Unknown account type {account_type}")
+
+            model = transaction_model_registry[account_type]
+            check_template(template, model, model.template_extras)
+
+        return templates
+
+    @model_validator(mode="after")
+    def check_header_template(self):
+        # Rendered with each account, which have different fields
+        for account in self.accounts:
+            check_template(self.header_template, type(account))
+
+        return self
+
+    @property
+    def accounts(self) -> list[Account]:
+        return [account for tenant in self.tenants for account in tenant.accounts]
 
     @classmethod
     def read_config(cls, file_path):
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n"
+
+
+def is_permanent_error(err: Exception) -> bool:
+    """Whether Telegram rejected the message itself, like bad HTML or a blocked bot
+
+    Those fail the same way every time, unlike rate limits, server and network errors.
+    """
+    return (
+        isinstance(err, ApiTelegramException)
+        and err.error_code != 429
+        and err.error_code < 500
+    )
+
+
+class RateLimiter:
+    """Spaces calls so there are at most `rate` per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+
+        time.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def pack_messages(
+    header: str, texts: list[str], digest=False
+) -> list[tuple[str, list[int]]]:
+    """Prefixes the header to every text, or packs as many texts per message as fit when digest is on
+
+    Returns each message along with the indexes of the texts it contains.
+    """
+    if not digest:
+        return [(header + text, [index]) for index, text in enumerate(texts)]
+
+    messages: list[tuple[str, list[int]]] = []
+    # The message being packed, only joined once it's full
+    parts: list[str] = []
+    indexes: list[int] = []
+    length = 0
+
+    for index, text in enumerate(texts):
+        packed_length = length + len(DIGEST_SEPARATOR) + len(text)
+        if parts and packed_length <= TELEGRAM_MESSAGE_LIMIT:
+            parts += (DIGEST_SEPARATOR, text)
+            indexes.append(index)
+            length = packed_length
+            continue
+
+        if parts:
+            messages.append(("".join(parts), indexes))
+
+        parts, indexes = [header, text], [index]
+        length = len(header) + len(text)
+
+    if parts:
+        messages.append(("".join(parts), indexes))
+
+    return messages
+
+
+class TelegramDelivery:
+    """Sends messages concurrently while keeping within Telegram's rate limits
+
+    Telegram allows around one message per second on each chat and 30 per
+    second overall, going over that gets a 429 with a retry_after we honor.
+    """
+
+    def __init__(
+        self,
+        telegram: TeleBot,
+        workers=4,
+        chat_rate=1.0,
+        global_rate=30.0,
+        max_retries=5,
+    ):
+        self.telegram = telegram
+        self.executor = ThreadPoolExecutor(workers)
+        self.max_retries = max_retries
+
+        self.chat_rate = chat_rate
+        self.chat_limiters: dict[str, RateLimiter] = {}
+        self.global_limiter = RateLimiter(global_rate)
+        self.lock = threading.Lock()
+
+    def _chat_limiter(self, chat_id):
+        with self.lock:
+            if chat_id not in self.chat_limiters:
+                self.chat_limiters[chat_id] = RateLimiter(self.chat_rate)
+            return self.chat_limiters[chat_id]
+
+    def _send(self, chat_id, text, **kwargs):
+        chat_limiter = self._chat_limiter(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            chat_limiter.wait()
+            self.global_limiter.wait()
+
+            try:
+                return self.telegram.send_message(chat_id, text, **kwargs)
+            except ApiTelegramException as err:
+                if err.error_code != 429 or attempt == self.max_retries:
+                    raise
+
+                parameters = err.result_json.get("parameters", {})
+                retry_after = parameters.get("retry_after", 1)
+                logger.warning(f"Rate limited by Telegram, retrying in {retry_after}s")
+                chat_limiter.pause(retry_after)
+
+    def send(self, messages: list[tuple[str, str]], **kwargs) -> list[Exception | None]:
+        """Sends every (chat_id, text) and waits for them, returns the error of each one, if any"""
+        futures = [
+            self.executor.submit(self._send, chat_id, text, **kwargs)
+            for chat_id, text in messages
+        ]
+
+        return [future.exception() for future in futures]
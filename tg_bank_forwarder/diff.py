@@ -0,0 +1,108 @@
+from collections import defaultdict, deque
+from collections.abc import Hashable, Sequence
+from difflib import SequenceMatcher
+from typing import Protocol, TypeVar
+
+
+class Matchable(Protocol):
+    similarity_threshold: float
+
+    def match_key(self) -> Hashable:
+        ...
+
+    def bucket_key(self) -> Hashable | None:
+        ...
+
+    def similarity(self, other) -> float:
+        ...
+
+
+T = TypeVar("T", bound=Matchable)
+
+
+def text_similarity(a: str, b: str) -> float:
+    """How alike two texts are, from 0 to 1, ignoring case"""
+    a, b = a.casefold(), b.casefold()
+    if a == b:
+        return 1.0
+
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def diff_transactions(
+    cached: Sequence[T], current: Sequence[T], fuzzy=True
+) -> dict[str, list[T]]:
+    """Matches current transactions against cached ones by their match key.
+
+    Cached transactions are bucketed in a multiset keyed by `match_key()`, so
+    identical duplicates are matched one to one and in cache order, exactly
+    like the old linear scan did, but in O(n+m).
+
+    When `fuzzy`, whatever is left unmatched is then bucketed by `bucket_key()`,
+    the fields that don't change, and matched by the similarity of the ones
+    that drift, only within its bucket. Those matches are the "~" modifications.
+    """
+    buckets: defaultdict[Hashable, deque[int]] = defaultdict(deque)
+    for index, ca_t in enumerate(cached):
+        buckets[ca_t.match_key()].append(index)
+
+    matched: set[int] = set()
+    matches = []  # Keep cu_t, even if they match, cu_t is fresh
+    additions = []  # unmatched
+
+    for cu_t in current:
+        bucket = buckets.get(cu_t.match_key())
+
+        if bucket:
+            matched.add(bucket.popleft())
+            matches.append(cu_t)
+        else:
+            additions.append(cu_t)
+
+    modifications = []  # Matched by similarity, cu_t as well
+    if fuzzy and additions:
+        additions, modifications = fuzzy_match(cached, matched, additions)
+
+    # Any transaction left on the cache has been deleted, since it wasn't matched
+    deletions = [ca_t for index, ca_t in enumerate(cached) if index not in matched]
+
+    return {
+        "-": deletions,
+        "=": matches,
+        "~": modifications,
+        "+": additions,
+    }
+
+
+def fuzzy_match(
+    cached: Sequence[T], matched: set[int], unmatched: list[T]
+) -> tuple[list[T], list[T]]:
+    """Returns the unmatched that are still additions, and those that were modified"""
+    leftovers: defaultdict[Hashable, list[int]] = defaultdict(list)
+    for index, ca_t in enumerate(cached):
+        if index not in matched:
+            key = ca_t.bucket_key()
+            if key is not None:
+                leftovers[key].append(index)
+
+    additions = []
+    modifications = []
+
+    for cu_t in unmatched:
+        candidates = leftovers.get(cu_t.bucket_key())
+
+        if candidates:
+            # Buckets are tiny, it's the same day, amount and type
+            score, position = max(
+                (cu_t.similarity(cached[index]), -position)
+                for position, index in enumerate(candidates)
+            )
+
+            if score >= cu_t.similarity_threshold:
+                matched.add(candidates.pop(-position))
+                modifications.append(cu_t)
+                continue
+
+        additions.append(cu_t)
+
+    return additions, modifications
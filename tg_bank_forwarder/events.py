@@ -0,0 +1,285 @@
+"""Append-only log of the changes found on every account, for downstream consumers
+
+Usage: python -m tg_bank_forwarder.events [--after SEQ] [--follow]
+
+Every addition, modification and deletion a check finds is an event, numbered
+from 1 with no gaps, and stored as JSON lines on segments of EventLog.segment_size
+events, named after the first seq they hold. The index lists the segments, so
+reading after a seq only goes through what's new. Events are written before the
+cache is updated, like the outbox, so they are delivered at least once: after a
+crash the same change can show up again with a later seq.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Condition, Thread
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlparse
+
+from .metrics import metrics
+from .records import TransactionRecord, record_encoder
+
+if TYPE_CHECKING:
+    from .config import Account
+
+logger = logging.getLogger(__name__)
+
+EVENTS_DIR = Path("state", "events")
+SEGMENT_SIZE = 10_000
+
+# Matches aren't changes, they aren't logged
+EVENT_KINDS = {"+": "added", "~": "modified", "-": "deleted"}
+
+# Long polls wait at most this long, in seconds, and return at most this many
+MAX_WAIT = 60
+MAX_LIMIT = 1000
+
+
+def make_event(account: Account, kind: str, transaction: TransactionRecord) -> dict:
+    return {
+        "tenant": account.tenant,
+        "account": account.name,
+        "type": account.type,
+        "kind": kind,
+        # Modified transactions come in their current version, under their new key
+        "key": transaction.match_key(),
+        "transaction": transaction,
+    }
+
+
+class EventLog:
+    """The log on disk, appended to by the bot and read by anyone"""
+
+    def __init__(self, path: Path = EVENTS_DIR, segment_size=SEGMENT_SIZE):
+        self.path = Path(path)
+        self.segment_size = segment_size
+        # Held while appending, readers on this process wait on it for new events
+        self.condition = Condition()
+
+        self.segments = self.load_index()
+        self.last_seq = self.segments[-1] - 1 if self.segments else 0
+        for _ in self.read(self.last_seq):
+            self.last_seq += 1
+
+        # Only opened when appending, readers never write
+        self.file = None
+
+    @property
+    def index_path(self) -> Path:
+        return self.path / "index.json"
+
+    def segment_path(self, first_seq: int) -> Path:
+        return self.path / f"{first_seq:020d}.jsonl"
+
+    def load_index(self) -> list[int]:
+        """First seq of each segment, in order"""
+        try:
+            return json.loads(self.index_path.read_text())["segments"]
+        except FileNotFoundError:
+            return []
+
+    def save_index(self):
+        tmp_path = self.index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"segments": self.segments}))
+        tmp_path.replace(self.index_path)
+
+    def _open_segment(self):
+        if self.file:
+            self.file.close()
+
+        first_seq = self.last_seq + 1
+        if not self.segments or first_seq - self.segments[-1] >= self.segment_size:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.segments.append(first_seq)
+            # Listed before anything is written to it, readers skip a missing file
+            self.save_index()
+
+        path = self.segment_path(self.segments[-1])
+        self.file = open(path, "a+b")
+
+        # An event left half written by a crash is dropped, it was never read
+        self.file.seek(0)
+        content = self.file.read()
+        complete = content.rfind(b"\n") + 1
+        if complete != len(content):
+            logger.warning(f"Dropping a partially written event from {path}")
+            self.file.truncate(complete)
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def append(self, events: list[dict]) -> int:
+        """Numbers and writes the events, returns the last seq"""
+        if not events:
+            return self.last_seq
+
+        with self.condition:
+            for event in events:
+                if self.file is None:
+                    self._open_segment()
+                elif self.last_seq + 1 - self.segments[-1] >= self.segment_size:
+                    self._sync()
+                    self._open_segment()
+
+                self.last_seq += 1
+                event = {"seq": self.last_seq, "time": time.time(), **event}
+                line = json.dumps(event, default=record_encoder) + "\n"
+                self.file.write(line.encode())
+
+            self._sync()
+            self.condition.notify_all()
+
+        metrics.inc("events", len(events))
+
+        return self.last_seq
+
+    def read(self, after=0, limit: int | None = None) -> Iterator[dict]:
+        """Streams the events with a seq greater than `after`, as they're on disk now
+
+        Works from other processes too, the index is read again every time.
+        """
+        segments = self.load_index()
+        start = max(bisect_right(segments, after) - 1, 0)
+
+        for first_seq in segments[start:]:
+            try:
+                f = open(self.segment_path(first_seq))
+            except FileNotFoundError:
+                return
+
+            with f:
+                # Seqs have no gaps, so lines are skipped without parsing them
+                skip = max(after + 1 - first_seq, 0)
+                for line in f:
+                    # Still being written
+                    if not line.endswith("\n"):
+                        return
+
+                    if skip:
+                        skip -= 1
+                        continue
+
+                    if limit is not None:
+                        if limit <= 0:
+                            return
+                        limit -= 1
+
+                    yield json.loads(line)
+
+    def wait(self, after: int, timeout: float) -> bool:
+        """Waits for an event after `after` to be appended on this process"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.last_seq > after, timeout)
+
+    def follow(self, after=0, poll_interval: float = 5) -> Iterator[dict]:
+        """Streams the events after `after` forever, waiting for new ones"""
+        while True:
+            for event in self.read(after):
+                after = event["seq"]
+                yield event
+
+            # Only appends on this process wake it up, others are polled
+            self.wait(after, poll_interval)
+
+    def serve(self, port: int, host: str = ""):
+        """Serves the events over HTTP long polling on a daemon thread
+
+        GET /events?after=SEQ&limit=N&wait=SECONDS returns the events after SEQ as
+        JSON lines, waiting up to SECONDS for some when there are none yet.
+        """
+        log = self
+
+        class EventsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/events":
+                    self.send_error(404)
+                    return
+
+                try:
+                    query = {k: int(v[0]) for k, v in parse_qs(url.query).items()}
+                except ValueError:
+                    self.send_error(400, "Parameters must be integers")
+                    return
+
+                after = query.get("after", 0)
+                limit = min(query.get("limit", MAX_LIMIT), MAX_LIMIT)
+                wait = min(query.get("wait", 0), MAX_WAIT)
+
+                if wait and log.last_seq <= after:
+                    log.wait(after, wait)
+
+                body = "".join(
+                    json.dumps(event) + "\n" for event in log.read(after, limit)
+                ).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), EventsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving events on port {server.server_address[1]}")
+
+        return server
+
+
+# Only there when enabled on the config
+event_log: EventLog | None = None
+
+
+def configure_events(enabled: bool):
+    global event_log
+    event_log = EventLog() if enabled else None
+
+
+def serve_events(port: int):
+    if event_log is None:
+        logger.warning("Not serving events, the event log isn't enabled")
+        return
+
+    event_log.serve(port)
+
+
+def append_events(account: Account, diff: dict[str, list[TransactionRecord]]):
+    if event_log is None:
+        return
+
+    event_log.append(
+        [
+            make_event(account, kind, transaction)
+            for key, kind in EVENT_KINDS.items()
+            for transaction in diff[key]
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints the events as JSON lines")
+    parser.add_argument("--after", type=int, default=0, help="Events after this seq")
+    parser.add_argument("--follow", action="store_true", help="Keep waiting for more")
+    args = parser.parse_args()
+
+    log = EventLog()
+    events = log.follow(args.after) if args.follow else log.read(args.after)
+
+    for event in events:
+        print(json.dumps(event), flush=True)
+
+
+if __name__ == "__main__":
+    main()
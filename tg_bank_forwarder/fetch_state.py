@@ -0,0 +1,78 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+FETCH_STATE_PATH = Path("state", "fetch_state.json")
+
+
+class Unchanged(Exception):
+    """The endpoint answered the same thing as the last time it was processed"""
+
+
+class FetchState:
+    """Remembers the last response of every endpoint, by account, to skip unchanged ones
+
+    A response is only remembered once commit() is called, after it was
+    processed, so a failed run doesn't cause the next one to skip it.
+    """
+
+    def __init__(self, path=FETCH_STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending: dict[str, dict[str, dict]] = {}
+
+        try:
+            with open(path) as f:
+                self.state: dict[str, dict] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.state = {}
+
+    def request_headers(self, account_name: str, url: str) -> dict[str, str]:
+        last = self.state.get(f"{account_name}:{url}", {})
+        headers = {}
+
+        if last.get("etag"):
+            headers["If-None-Match"] = last["etag"]
+        if last.get("last_modified"):
+            headers["If-Modified-Since"] = last["last_modified"]
+
+        return headers
+
+    def check(self, account_name: str, url: str, status: int, headers, body: bytes):
+        """Raises Unchanged if the response is the same as the last one"""
+        key = f"{account_name}:{url}"
+        headers = {k.lower(): v for k, v in headers.items()}
+        digest = hashlib.sha256(body).hexdigest()
+
+        if status == 304 or self.state.get(key, {}).get("sha256") == digest:
+            raise Unchanged(key)
+
+        with self.lock:
+            self.pending.setdefault(account_name, {})[key] = {
+                "sha256": digest,
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+            }
+
+    def take_pending(self, account_name: str) -> dict[str, dict]:
+        """Hands the responses not yet committed over to another process"""
+        with self.lock:
+            return self.pending.pop(account_name, {})
+
+    def add_pending(self, account_name: str, pending: dict[str, dict]):
+        with self.lock:
+            self.pending.setdefault(account_name, {}).update(pending)
+
+    def commit(self, account_name: str):
+        with self.lock:
+            self.state.update(self.pending.pop(account_name, {}))
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            tmp_path.replace(self.path)
+
+
+fetch_state = FetchState()
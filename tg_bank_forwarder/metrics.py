@@ -0,0 +1,143 @@
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "tg_bank_forwarder"
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """Phase timings and counters for the current process, rendered as OpenMetrics"""
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        # (phase, labels) -> [total seconds, count]
+        self.durations: dict[tuple[str, Labels], list[float]] = {}
+        # (name, labels) -> value
+        self.counters: dict[tuple[str, Labels], float] = {}
+
+    @staticmethod
+    def labels(labels: dict) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, phase: str, seconds: float, **labels):
+        key = (phase, self.labels(labels))
+
+        with self.lock:
+            duration = self.durations.setdefault(key, [0.0, 0])
+            duration[0] += seconds
+            duration[1] += 1
+
+    @contextmanager
+    def timer(self, phase: str, **labels):
+        """Times the block as `phase`, failed runs are timed too"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start, **labels)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self.labels(labels))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> tuple[dict, dict]:
+        with self.lock:
+            durations = {key: list(value) for key, value in self.durations.items()}
+            return durations, dict(self.counters)
+
+    def merge(self, durations: dict, counters: dict):
+        """Adds up what another process measured"""
+        with self.lock:
+            for key, (total, count) in durations.items():
+                duration = self.durations.setdefault(key, [0.0, 0])
+                duration[0] += total
+                duration[1] += count
+
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self) -> str:
+        with self.lock:
+            durations = sorted(self.durations.items())
+            counters = sorted(self.counters.items())
+
+        lines = [
+            f"# TYPE {PREFIX}_phase_seconds summary",
+            f"# UNIT {PREFIX}_phase_seconds seconds",
+            f"# HELP {PREFIX}_phase_seconds Time spent on each phase of a check",
+        ]
+        for (phase, labels), (total, count) in durations:
+            labels = format_labels((("phase", phase), *labels))
+            lines.append(f"{PREFIX}_phase_seconds_sum{labels} {total}")
+            lines.append(f"{PREFIX}_phase_seconds_count{labels} {count}")
+
+        names = sorted({name for (name, _), _ in counters})
+        for name in names:
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            for (counter, labels), value in counters:
+                if counter == name:
+                    labels = format_labels(labels)
+                    lines.append(f"{PREFIX}_{name}_total{labels} {value}")
+
+        lines.append("# EOF")
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically writes the metrics, for node_exporter's textfile collector"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.render())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    def serve(self, port: int, host: str = ""):
+        """Serves the metrics over HTTP on a daemon thread"""
+        render = self.render
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on port {server.server_address[1]}")
+
+        return server
+
+
+metrics = Metrics()
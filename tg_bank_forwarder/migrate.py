@@ -0,0 +1,82 @@
+"""Imports the JSON cache, and the diffs on its git history, into the SQLite storage
+
+Usage: python -m tg_bank_forwarder.migrate [config.yml]
+
+Running it again is safe. Each account is imported on a single transaction,
+which records it as migrated, and accounts already recorded are skipped. So
+nothing is imported twice and nothing the bot stored since is touched.
+"""
+import json
+import sys
+import time
+
+from dulwich.errors import NotGitRepository
+from dulwich.object_store import tree_lookup_path
+from dulwich.repo import Repo
+
+from .config import Config
+from .records import TransactionRecord
+from .transaction_cache import CACHE_DIR, JSONStorage, SQLiteStorage
+
+
+def migrate_diffs(repo: Repo, storage: SQLiteStorage, account):
+    path = f"{account.qualified_name}-diff.json".encode()
+
+    for entry in repo.get_walker(paths=[path], reverse=True):
+        commit = entry.commit
+        try:
+            _, sha = tree_lookup_path(repo.__getitem__, commit.tree, path)
+        except KeyError:
+            continue  # Deleted on this commit
+
+        raw_diff = json.loads(repo[sha].data)
+        diff = {
+            kind: [
+                TransactionRecord(account.transaction_model, data)
+                for data in raw_diff.get(kind, [])
+            ]
+            for kind in ["-", "~", "+"]
+        }
+        storage.store_diff(account, diff, created_at=commit.commit_time)
+
+
+def is_migrated(storage: SQLiteStorage, account) -> bool:
+    row = storage.db.execute(
+        "SELECT 1 FROM migrations WHERE account = ?", (account.qualified_name,)
+    ).fetchone()
+    return row is not None
+
+
+def migrate_account(repo: Repo | None, storage: SQLiteStorage, account):
+    with storage.transaction():
+        if repo:
+            migrate_diffs(repo, storage, account)
+
+        storage.store(account, JSONStorage().load(account))
+
+        storage.db.execute(
+            "INSERT INTO migrations (account, migrated_at) VALUES (?, ?)",
+            (account.qualified_name, time.time()),
+        )
+
+
+def main(config_path="config.yml"):
+    config = Config.read_config(config_path)
+    storage = SQLiteStorage()
+
+    try:
+        repo = Repo(CACHE_DIR)
+    except NotGitRepository:
+        repo = None
+
+    for account in config.accounts:
+        if is_migrated(storage, account):
+            print(f"Skipping {account.qualified_name}, it's already on the database")
+            continue
+
+        print(f"Migrating {account.qualified_name}")
+        migrate_account(repo, storage, account)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
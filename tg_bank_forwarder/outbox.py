@@ -0,0 +1,143 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from .metrics import metrics
+from .templates import render_header, render_transactions
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = Path("state", "outbox.sqlite3")
+
+# Retries wait 30s, 1m, 2m... up to an hour
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+# Sent messages are kept this long so their keys keep deduplicating
+KEEP_SENT = 30 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    chat_id TEXT NOT NULL,
+    header TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    sent_at REAL,
+    last_error TEXT,
+    rejected_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (sent_at, next_attempt_at);
+"""
+
+
+def transaction_key(account, transaction) -> str:
+    distinct = [transaction.data[f] for f in transaction.model_class.distinct_fields]
+    return json.dumps(
+        [account.qualified_name, transaction.match_key(), *distinct], default=str
+    )
+
+
+def transaction_keys(account, transactions, existing=()) -> list[str]:
+    """Idempotency keys, duplicated transactions get their occurrence appended
+
+    Occurrences are counted after the `existing` transactions with the same key,
+    the ones already fetched before, so the same purchase made twice gets a new
+    key the second time even if it shows up on a later poll. Once the first one
+    isn't fetched anymore, only the model's distinct_fields tell them apart.
+    """
+    seen = Counter(transaction_key(account, t) for t in existing)
+    keys = []
+
+    for transaction in transactions:
+        key = transaction_key(account, transaction)
+        seen[key] += 1
+        keys.append(f"{key}:{seen[key]}")
+
+    return keys
+
+
+class Outbox:
+    """Notifications waiting to be delivered, so they survive failures and restarts
+
+    Transactions are queued before the cache forgets about them and are only
+    removed once delivered, which makes delivery at least once.
+    """
+
+    def __init__(self, path=OUTBOX_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+        # Outboxes from before messages could be rejected
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(outbox)")}
+        if "rejected_at" not in columns:
+            with self.db:
+                self.db.execute("ALTER TABLE outbox ADD COLUMN rejected_at REAL")
+
+    def queue_transactions(self, chat_id, account, transactions, existing=()):
+        """Queues the new transactions, `existing` are the rest of the current fetch"""
+        header = render_header(account)
+        with metrics.timer("render"):
+            texts = render_transactions(account, transactions)
+
+        now = time.time()
+        rows = [
+            (key, chat_id, header, text, now, now)
+            for key, text in zip(
+                transaction_keys(account, transactions, existing), texts
+            )
+        ]
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO outbox (key, chat_id, header, text, created_at, next_attempt_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def pending(self):
+        with self.lock:
+            return self.db.execute(
+                "SELECT id, chat_id, header, text, attempts FROM outbox"
+                " WHERE sent_at IS NULL AND rejected_at IS NULL AND next_attempt_at <= ?"
+                " ORDER BY id",
+                (time.time(),),
+            ).fetchall()
+
+    def mark_sent(self, ids: list[int]):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE outbox SET sent_at = ? WHERE id = ?", [(now, id) for id in ids]
+            )
+            self.db.execute(
+                "DELETE FROM outbox WHERE sent_at < ? OR rejected_at < ?",
+                (now - KEEP_SENT, now - KEEP_SENT),
+            )
+
+    def mark_failed(self, ids: list[int], attempts: int, err: Exception):
+        delay = min(BACKOFF_BASE * 2**attempts, BACKOFF_MAX)
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?"
+                " WHERE id = ?",
+                [(time.time() + delay, str(err), id) for id in ids],
+            )
+
+    def mark_rejected(self, ids: list[int], err: Exception):
+        """Never retried, resending would fail the same way. Kept so keys still deduplicate"""
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, rejected_at = ?, last_error = ?"
+                " WHERE id = ?",
+                [(time.time(), str(err), id) for id in ids],
+            )
@@ -0,0 +1,65 @@
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from .providers.registry import provider_registry
+
+if TYPE_CHECKING:
+    from .config import Account
+
+
+@dataclass
+class Session:
+    """Accounts that are checked on a single login"""
+
+    tenant: str
+    provider: str
+    credentials_env: str
+    accounts: list["Account"] = field(default_factory=list)
+
+    @property
+    def name(self):
+        name = f"{self.provider}:{self.credentials_env}"
+        return f"{self.tenant}:{name}" if self.tenant else name
+
+    def endpoints(self) -> dict[str, list["Account"]]:
+        """Accounts by the endpoint they are fetched from, each one is only fetched once"""
+        provider_class = provider_registry[self.provider]
+        endpoints: dict[str, list["Account"]] = {}
+
+        for account in self.accounts:
+            endpoint = provider_class.endpoint_for(account)
+            endpoints.setdefault(endpoint, []).append(account)
+
+        return endpoints
+
+
+def build_plan(accounts: Sequence["Account"]) -> list[Session]:
+    """One session per tenant, provider and credentials, whatever the config order
+
+    Tenants don't share sessions, even with the same credentials, so an error on
+    one of them never affects the others.
+    """
+    sessions: dict[tuple[str, str, str], Session] = {}
+
+    for account in accounts:
+        key = (account.tenant, account.provider, account.credentials_env)
+        if key not in sessions:
+            sessions[key] = Session(*key)
+
+        sessions[key].accounts.append(account)
+
+    return list(sessions.values())
+
+
+def describe_plan(plan: list[Session]) -> str:
+    lines = []
+
+    for session in plan:
+        lines.append(f"{session.name}: 1 login, {len(session.accounts)} accounts")
+
+        for endpoint, accounts in session.endpoints().items():
+            names = ", ".join(account.name for account in accounts)
+            lines.append(f"    {endpoint}: {names}")
+
+    return "\n".join(lines)
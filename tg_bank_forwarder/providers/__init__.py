@@ -1,9 +1,22 @@
-from .base import BaseProvider
-from .itau import ItauProvider
-from .sistarbanc import SistarbancProvider
+from typing import TYPE_CHECKING
+
+from .registry import provider_classes
+
+if TYPE_CHECKING:
+    from .base import BaseProvider
+    from .itau import ItauProvider
+    from .sistarbanc import SistarbancProvider
 
 __all__ = [
     "BaseProvider",
     "SistarbancProvider",
     "ItauProvider",
 ]
+
+
+# Providers pull heavy dependencies, so they are imported on first access
+def __getattr__(name):
+    if name in provider_classes:
+        return provider_classes[name]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,69 +1,238 @@
-from typing import TYPE_CHECKING
-
-from pydantic import BaseModel
-
-from ..transaction_cache import load_transactions, store_transactions
+import logging
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, ClassVar
+
+from pydantic import BaseModel, ConfigDict
+
+from ..diff import diff_transactions, text_similarity
+from ..events import append_events
+from ..fetch_state import Unchanged, fetch_state
+from ..metrics import metrics
+from ..records import TransactionRecord, freeze
+from ..retention import apply_retention
+from ..session_store import SessionStore
+from ..templates import compile_template
+from ..transaction_cache import (
+    cache_lock,
+    load_transactions,
+    store_diff,
+    store_transactions,
+)
 
 if TYPE_CHECKING:
     from ..config import Account
 
+logger = logging.getLogger(__name__)
+
+# Seconds to connect and between bytes, a stalled bank would hold a worker forever
+REQUEST_TIMEOUT = 30
+
+
+class SessionExpired(Exception):
+    pass
+
+
+class BaseTransaction(BaseModel):
+    # Banks aren't consistent on whether ids and codes are numbers or strings
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    # Fields that must be equal for two transactions to be considered the same one
+    match_fields: ClassVar[tuple[str, ...]] = ()
+
+    # Transactions that don't match but are equal on these fields, and whose
+    # similar_fields are at least similarity_threshold alike, were modified
+    bucket_fields: ClassVar[tuple[str, ...]] = ()
+    similar_fields: ClassVar[tuple[str, ...]] = ()
+    similarity_threshold: ClassVar[float] = 0.8
+
+    # Not needed to match, but they tell apart transactions that match, like the
+    # time of a purchase. Notifications are keyed by them, see outbox.py
+    distinct_fields: ClassVar[tuple[str, ...]] = ()
+
+    # When the transaction happened, retention windows go by it
+    date_field: ClassVar[str]
+    # Whether the bank only lists the latest ones, so that older transactions
+    # disappearing weren't deleted, see retention.py
+    windowed: ClassVar[bool] = False
+
+    # Notification HTML, rendered with template_values, see templates.py
+    template: ClassVar[str]
+    # Fields template_values adds to the model's
+    template_extras: ClassVar[tuple[str, ...]] = ()
+
+    @classmethod
+    def match_key_from_data(cls, data: dict) -> tuple:
+        return tuple(freeze(data[field]) for field in cls.match_fields)
+
+    @classmethod
+    def day_from_data(cls, data: dict) -> str:
+        """The date as YYYY-MM-DD, whether data comes from a model or from its JSON"""
+        return freeze(data[cls.date_field])[:10]
+
+    @classmethod
+    def bucket_key_from_data(cls, data: dict) -> tuple | None:
+        if not cls.bucket_fields:
+            return None
+        return tuple(freeze(data[field]) for field in cls.bucket_fields)
+
+    @classmethod
+    def similarity_from_data(cls, data: dict, other: dict) -> float:
+        scores = [
+            text_similarity(str(data[field]), str(other[field]))
+            for field in cls.similar_fields
+        ]
+        return sum(scores) / len(scores) if scores else 0.0
+
+    @classmethod
+    def template_values(cls, data: dict) -> dict:
+        """What templates are rendered with, models can add fields of their own"""
+        return data
+
+    @classmethod
+    def format_from_data(cls, data: dict) -> str:
+        return compile_template(cls.template).render(cls.template_values(data))
+
+    def format(self) -> str:
+        return self.format_from_data(self.__dict__)
+
+    def match_key(self) -> tuple:
+        return self.match_key_from_data(self.__dict__)
+
+    def bucket_key(self) -> tuple | None:
+        return self.bucket_key_from_data(self.__dict__)
+
+    def similarity(self, other) -> float:
+        return self.similarity_from_data(self.__dict__, other.__dict__)
+
+    def matches(self, other):
+        return self.match_key() == other.match_key()
+
+
+class BaseProvider(ABC):
+    # Same as in the provider registry, used to label metrics
+    name: ClassVar[str]
+
+    # Where the session is saved between runs
+    session_store: SessionStore
+
+    # Whether we logged in during this run, as opposed to reusing a saved session
+    logged_in = False
+
+    # Where each account type is fetched from, formatted with the account
+    endpoints: ClassVar[dict[str, str]] = {}
+
+    @classmethod
+    def endpoint_for(cls, account: "Account") -> str:
+        return cls.endpoints[account.type].format(account=account)
 
-class BaseProvider:
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
         pass
 
+    @abstractmethod
+    def login(self):
+        """Logs in with the credentials, sets logged_in and saves the session"""
+
+    @classmethod
+    def timer(cls, phase: str, account: "Account | None" = None):
+        return metrics.timer(
+            phase,
+            provider=cls.name,
+            tenant=account.tenant if account else "",
+            account=account.name if account else "",
+        )
+
+    def with_session(self, request, *args, **kwargs):
+        """Runs the request, logging in and retrying once if the saved session expired"""
+        try:
+            return request(*args, **kwargs)
+        except SessionExpired:
+            # Later runs, and the login budget, shouldn't count on it anymore
+            self.session_store.clear()
+
+            if self.logged_in:
+                raise
+
+            logger.info(f"Saved session for {self!r} expired, logging in")
+            self.login()
+
+            return request(*args, **kwargs)
+
     def get_transactions_for_account(self, account: "Account") -> list[BaseModel]:
         # mypy doesn't love getattr
         return getattr(self, f"fetch_{account.type}")(account)
 
-    def compare_transactions(self, account: "Account"):
+    def fetch_records(self, account: "Account") -> list[TransactionRecord]:
+        """Raises Unchanged when the account didn't change at all"""
+        return [
+            TransactionRecord.from_model(t)
+            for t in self.get_transactions_for_account(account)
+        ]
+
+    def compare_transactions(self, account: "Account", on_diff=None):
+        """Returns the diff against the cache, or None when the account didn't change at all"""
+        try:
+            current_transactions = self.fetch_records(account)
+        except Unchanged:
+            self.count_unchanged(account)
+            return None
+
+        return self.reconcile(account, current_transactions, on_diff)
+
+    @classmethod
+    def count_unchanged(cls, account: "Account"):
+        metrics.inc(
+            "unchanged_accounts",
+            provider=cls.name,
+            tenant=account.tenant,
+            account=account.name,
+        )
+
+    @classmethod
+    def reconcile(
+        cls,
+        account: "Account",
+        current_transactions: list[TransactionRecord],
+        on_diff=None,
+    ):
+        """Diffs what was fetched against the cache, and updates it
+
+        Only this touches the cache, so it can run apart from the fetching.
+        """
         # TODO: Move this outside of here, providers should just provide, not compare
-        current_transactions = self.get_transactions_for_account(account)
-        cached_transactions = load_transactions(account)
-
-        store_transactions(account, current_transactions)
+        labels = {
+            "provider": cls.name,
+            "tenant": account.tenant,
+            "account": account.name,
+        }
 
-        # new_transactions = {k:list(v) for k, v in groupby(cached_transactions, lambda t: [t.card, t.title, t.mov, t.cu t.amount, t.currency])}
+        with cache_lock:
+            with cls.timer("cache_load", account):
+                cached_transactions = load_transactions(account)
 
-        transaction_mapping = []
-        new_transactions = []  # unmtched
+            with cls.timer("diff", account):
+                diff = diff_transactions(cached_transactions, current_transactions)
 
-        for cu_t in current_transactions:
-            # try to find a match in the cache.
+            with cls.timer("retention", account):
+                working_set = apply_retention(account, current_transactions, diff)
 
-            try:
-                matching_index = next(
-                    index
-                    for index, ca_t in enumerate(cached_transactions)
-                    if ca_t.matches(cu_t)
-                )
-                ca_t = cached_transactions.pop(matching_index)
-                transaction_mapping.append((cu_t, ca_t))
+            # Runs before the cache is updated, so nothing is lost if it fails
+            if on_diff:
+                on_diff(account, diff)
+            append_events(account, diff)
 
-            except StopIteration:
-                new_transactions.append(cu_t)
+            with cls.timer("cache_store", account):
+                store_transactions(account, working_set)
 
-        deletions = cached_transactions  # Any transaction left on the cache list has been deleted, since it wasn't matched
-        matches = [
-            cu_t for cu_t, ca_t in transaction_mapping
-        ]  # Take the cu_t from the mapping given that even if they match, cu_t is fresh
-        additions = new_transactions  # By Definition
+                # TODO: Move this out of here:
+                store_diff(account, diff)
 
-        diff = {
-            "-": deletions,
-            "=": matches,
-            "+": additions,
-        }
+        fetch_state.commit(account.qualified_name)
 
-        from ..transaction_cache import store_diff
-
-        # TODO: Move this out of here:
-        store_diff(account, diff)
+        changes = (("new", "+"), ("matched", "="), ("modified", "~"), ("deleted", "-"))
+        for change, key in changes:
+            metrics.inc("transactions", len(diff[key]), change=change, **labels)
 
         return diff
-
-    def get_new_transactions(self, account: "Account"):
-        return self.compare_transactions(account)["+"]
@@ -1,13 +1,16 @@
 import json
-from datetime import date
+from datetime import date, datetime, timezone
 from os import environ
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, ClassVar, Literal
 from urllib.parse import urljoin
 
-from playwright.sync_api import sync_playwright
-from pydantic import BaseModel, validator
+import requests
+from pydantic import TypeAdapter, field_validator
 
-from .base import BaseProvider
+from ..browser import close_browser_pool, get_browser_pool
+from ..fetch_state import fetch_state
+from ..session_store import SessionStore
+from .base import REQUEST_TIMEOUT, BaseProvider, BaseTransaction, SessionExpired
 
 if TYPE_CHECKING:
     from ..config import ItauBankAccount, ItauCardAuthorizationsAccount
@@ -15,7 +18,12 @@ if TYPE_CHECKING:
 BASE_URL = "https://www.itaulink.com.uy/trx/"
 
 
-class ItauAccountTransaction(BaseModel):
+def millis_to_date(millis: int) -> date:
+    # Pydantic v1 used to do this for us, and it did it in UTC
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc).date()
+
+
+class ItauAccountTransaction(BaseTransaction):
     tipo: Literal["D", "C"] | str
     fecha: date
     descripcion: str
@@ -25,37 +33,38 @@ class ItauAccountTransaction(BaseModel):
     codigoFormulario: int  # What is this?
     saldo: float
 
-    @validator("fecha", pre=True)
+    @field_validator("fecha", mode="before")
+    @classmethod
     def validate_fecha(cls, field):
         if isinstance(field, dict):
-            return field["millis"] / 1000
+            return millis_to_date(field["millis"])
         elif isinstance(field, date):
             return field
         elif isinstance(field, str):
             return field
 
-    def matches(self, other):
-        return all(
-            [
-                self.tipo == other.tipo,
-                self.fecha == other.fecha,
-                self.descripcion
-                == other.descripcion,  # This one should be similar, not necesary equal for it to match
-                # self.descripcionAdicional == other.descripcionAdicional, # Unfortunately this one do change
-                self.importe == other.importe,
-            ]
-        )
-
-    def format(self):
-        text = f"<b>{self.tipo} {self.descripcion} {self.descripcionAdicional}</b>\n"
-        text += "\n"
-        text += f"<b>Fecha:</b> {self.fecha}\n"
-        text += "\n"
-        text += f"<b>Importe:</b> {self.importe}\n"
-        return text
-
-
-class ItauCardAuthorization(BaseModel):
+    match_fields: ClassVar[tuple[str, ...]] = (
+        "tipo",
+        "fecha",
+        "descripcion",  # This one should be similar, not necesary equal for it to match
+        # "descripcionAdicional", # Unfortunately this one do change
+        "importe",
+    )
+    bucket_fields: ClassVar[tuple[str, ...]] = ("tipo", "fecha", "importe")
+    date_field = "fecha"
+    windowed = True  # Only the current month
+    similar_fields: ClassVar[tuple[str, ...]] = ("descripcion",)
+
+    template = (
+        "<b>{tipo} {descripcion} {descripcionAdicional}</b>\n"
+        "\n"
+        "<b>Fecha:</b> {fecha}\n"
+        "\n"
+        "<b>Importe:</b> {importe}\n"
+    )
+
+
+class ItauCardAuthorization(BaseTransaction):
     tipo: Literal["COMPRA"] | str
     fecha: date
     tarjeta: str
@@ -69,107 +78,242 @@ class ItauCardAuthorization(BaseModel):
     etiqueta: Literal["Aprobada", "Negada"] | str
     aprobada: bool
 
-    @validator("fecha", pre=True)
+    @field_validator("fecha", mode="before")
+    @classmethod
     def validate_fecha(cls, field):
         if isinstance(field, dict):
-            return field["millis"] / 1000
+            return millis_to_date(field["millis"])
         elif isinstance(field, date):
             return field
         elif isinstance(field, str):
             return field
 
-    @validator("tarjeta", pre=True)
+    @field_validator("tarjeta", mode="before")
+    @classmethod
     def validate_tarjeta(cls, field):
         if isinstance(field, dict):
             return field["hash"]
         elif isinstance(field, str):
             return field
 
-    def matches(self, other):
-        # I can probably use Annotated in order to automate the declaration of which fields should be equal
-        # Which ones DO change, which ones SHOULD stay equal, and which ones MUST stay equal
-
-        # It's important when I integrate this with beancount that I also detect when some transaction matches, but has changed in some way
-
-        # TODO: Sort by precedence
-        return all(
-            [
-                self.tipo == other.tipo,
-                self.fecha == other.fecha,
-                self.tarjeta == other.tarjeta,
-                self.importe == other.importe,
-                self.nombreComercio == other.nombreComercio,
-                self.moneda == other.moneda,
-            ]
-        )
-
-    def format(self):
-        text = f"<b>{self.tipo} {self.nombreComercio}: {self.etiqueta}</b>\n"
-        text += "\n"
-        text += f"<b>Fecha:</b> {self.fecha} {self.hora}\n"
-        text += "\n"
-        text += f"<b>{self.moneda}:</b> {self.importe}\n"
-
-        return text
+    # I can probably use Annotated in order to automate the declaration of which fields should be equal
+    # Which ones DO change, which ones SHOULD stay equal, and which ones MUST stay equal
+
+    # It's important when I integrate this with beancount that I also detect when some transaction matches, but has changed in some way
+    match_fields: ClassVar[tuple[str, ...]] = (
+        "tipo",
+        "fecha",
+        "tarjeta",
+        "importe",
+        "nombreComercio",
+        "moneda",
+    )
+    bucket_fields: ClassVar[tuple[str, ...]] = (
+        "tipo",
+        "fecha",
+        "tarjeta",
+        "importe",
+        "moneda",
+    )
+    similar_fields: ClassVar[tuple[str, ...]] = ("nombreComercio",)
+    # The same purchase on the same day, once the first one isn't pending anymore
+    distinct_fields: ClassVar[tuple[str, ...]] = ("hora",)
+    date_field = "fecha"
+
+    template = (
+        "<b>{tipo} {nombreComercio}: {etiqueta}</b>\n"
+        "\n"
+        "<b>Fecha:</b> {fecha} {hora}\n"
+        "\n"
+        "<b>{moneda}:</b> {importe}\n"
+    )
+
+
+account_transactions_adapter = TypeAdapter(list[ItauAccountTransaction])
+card_authorizations_adapter = TypeAdapter(list[ItauCardAuthorization])
 
 
 class ItauProvider(BaseProvider):
-    def __init__(self, credentials_env) -> None:
-        self.playwright = None
-        self.browser = None
+    name = "itau"
+    endpoints = {
+        "itau_bank_account": "cuentas/1/{account.id}/mesActual",
+        "itau_card_authorizations": "tarjetas/credito/{account.id}/autorizaciones_pendientes",
+    }
+
+    def __init__(
+        self, credentials_env, tenant="", http_fetch=False, base_url=BASE_URL
+    ) -> None:
         self.context = None
+        # Responses already fetched on this session, by url
+        self.responses: dict[str, tuple[int, dict, bytes]] = {}
+
+        # When enabled the browser is only used to log in, everything else goes through requests
+        self.http_fetch = http_fetch
+        self.http = requests.Session()
 
+        self.base_url = base_url
         self.credentials_env = credentials_env
+        self.session_store = SessionStore(credentials_env, tenant)
 
     def __repr__(self):
         return f"<ItauProvider {self.credentials_env=}>"
 
     def __enter__(self):
-        self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch()
-        self.context = self.browser.new_context()
-
-        username, password = environ[self.credentials_env].split(":")
-        self._login(username, password)
+        state = self.session_store.load()
+
+        try:
+            if self.http_fetch:
+                if state:
+                    self._load_http_cookies(state)
+                else:
+                    self.login()
+            else:
+                self._start_browser(state)
+
+                if not state:
+                    self.login()
+        except BaseException:
+            # __exit__ won't run, the context would be left open on the pool
+            self._stop_browser()
+            self.http.close()
+            raise
 
         return self
 
     def __exit__(self, type, value, traceback):
-        assert self.playwright, "ItauProvider not started"
+        if type is None:
+            self.session_store.save(self._storage_state())
 
-        self.playwright.stop()
+        self._stop_browser()
+        self.http.close()
 
-        self.playwright = None
-        self.browser = None
-        self.context = None
+    def _start_browser(self, state=None):
+        # The browser itself is shared, we only get an isolated context out of it
+        self.context = get_browser_pool().new_context(storage_state=state)
 
-    def _fetch(self, url):
-        assert self.context, "ItauProvider not started"
-        res = self.context.request.get(urljoin(BASE_URL, url))
+    def _stop_browser(self):
+        if self.context:
+            self.context.close()
+
+        self.context = None
 
-        body = res.body().decode("latin-1")
+    def _storage_state(self):
+        if self.context:
+            return self.context.storage_state()
+
+        # Same shape as Playwright's storage_state, so the browser can load it back
+        return {
+            "cookies": [
+                {
+                    "name": c.name,
+                    "value": c.value,
+                    "domain": c.domain,
+                    "path": c.path,
+                    "expires": c.expires or -1,
+                    "httpOnly": c.has_nonstandard_attr("HttpOnly"),
+                    "secure": c.secure,
+                    "sameSite": "Lax",
+                }
+                for c in self.http.cookies
+            ],
+            "origins": [],
+        }
+
+    def _load_http_cookies(self, state):
+        for cookie in state["cookies"]:
+            self.http.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie["domain"],
+                path=cookie["path"],
+            )
+
+    def _fetch(self, url, account=None):
+        """Fetches the data, raises Unchanged if it's the same the account processed last time"""
+        headers = (
+            fetch_state.request_headers(account.qualified_name, url) if account else {}
+        )
 
-        return json.loads(body)["itaulink_msg"]["data"]
+        if url in self.responses:
+            status, res_headers, body = self.responses[url]
+        elif self.http_fetch:
+            with self.timer("fetch", account):
+                res = self.http.get(
+                    urljoin(self.base_url, url),
+                    headers=headers,
+                    timeout=REQUEST_TIMEOUT,
+                )
+                status, res_headers, body = res.status_code, res.headers, res.content
+        else:
+            assert self.context, "ItauProvider not started"
+            with self.timer("fetch", account):
+                res = self.context.request.get(
+                    urljoin(self.base_url, url), headers=headers
+                )
+                status, res_headers, body = res.status, res.headers, res.body()
+
+        # Only conditional requests, which need an account, get a 304
+        if status == 304 and account:
+            fetch_state.check(account.qualified_name, url, status, res_headers, body)
+
+        try:
+            data = json.loads(body.decode("latin-1"))["itaulink_msg"]["data"]
+        except (ValueError, KeyError) as err:
+            # We don't get the usual payload back when we aren't logged in
+            raise SessionExpired(f"Unexpected response while fetching {url}") from err
+
+        if status == 200:
+            self.responses[url] = (status, res_headers, body)
+
+        if account:
+            fetch_state.check(account.qualified_name, url, status, res_headers, body)
+
+        return data
+
+    def login(self):
+        if not self.context:
+            self._start_browser()
+
+        try:
+            username, password = environ[self.credentials_env].split(":")
+            with self.timer("login"):
+                self._login(username, password)
+
+            self.logged_in = True
+            state = self._storage_state()
+            self.session_store.save(state)
+        finally:
+            if self.http_fetch:
+                # The browser is only needed to log in, so Chromium isn't kept around
+                self._stop_browser()
+                close_browser_pool()
+
+        if self.http_fetch:
+            self.http.cookies.clear()
+            self._load_http_cookies(state)
 
     def _login(self, username: str, password: str):
         assert self.context, "ItauProvider not started"
 
         page = self.context.new_page()
-        page.goto(BASE_URL)
+        page.goto(self.base_url)
 
         page.type("#documento", username)
         page.type("#pass", password)
 
         page.click("#vprocesar")
+        page.wait_for_load_state()
 
     def fetch_itau_card_authorizations(self, account: "ItauCardAuthorizationsAccount"):
-        data = self._fetch(f"tarjetas/credito/{account.id}/autorizaciones_pendientes")
+        data = self.with_session(self._fetch, self.endpoint_for(account), account)
         autorizaciones = data["datos"]["datosAutorizaciones"]["autorizaciones"]
 
-        return [ItauCardAuthorization(**a) for a in autorizaciones]
+        with self.timer("parse", account):
+            return card_authorizations_adapter.validate_python(autorizaciones)
 
     def fetch_itau_bank_account(self, account: "ItauBankAccount"):
-        data = self._fetch(f"cuentas/1/{account.id}/mesActual")
+        data = self.with_session(self._fetch, self.endpoint_for(account), account)
         movements = data["movimientosMesActual"]["movimientos"]
 
-        return [ItauAccountTransaction(**m) for m in movements]
+        with self.timer("parse", account):
+            return account_transactions_adapter.validate_python(movements)
@@ -1,14 +1,67 @@
-from typing import Union
+from collections.abc import Iterator, Mapping
+from importlib import import_module
+from typing import TYPE_CHECKING, Any, Union
 
-from . import ItauProvider, SistarbancProvider
+if TYPE_CHECKING:
+    from .base import BaseTransaction
+    from .itau import ItauProvider
+    from .sistarbanc import SistarbancProvider
 
-Provider = Union[
-    ItauProvider,
-    SistarbancProvider,
-]
+    Provider = Union[
+        ItauProvider,
+        SistarbancProvider,
+    ]
 
-# TODO: Implement some kind of decorator that registers providers when they are loaded
-provider_registry: dict[str, type[Provider]] = {
-    "itau": ItauProvider,
-    "sistarbanc": SistarbancProvider,
-}
+
+def load_object(path: str) -> Any:
+    module_name, name = path.split(":")
+    return getattr(import_module(module_name), name)
+
+
+class LazyRegistry(Mapping):
+    """Maps names to "module:attribute" paths, only importing them when looked up
+
+    So a run that doesn't have Itau accounts never imports Playwright, for example.
+    """
+
+    def __init__(self, paths: dict[str, str]):
+        self.paths = paths
+        self.loaded: dict[str, Any] = {}
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            self.loaded[name] = load_object(self.paths[name])
+        return self.loaded[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+# The classes the providers package exports, by name
+provider_classes = LazyRegistry(
+    {
+        "BaseProvider": "tg_bank_forwarder.providers.base:BaseProvider",
+        "ItauProvider": "tg_bank_forwarder.providers.itau:ItauProvider",
+        "SistarbancProvider": "tg_bank_forwarder.providers.sistarbanc:SistarbancProvider",
+    }
+)
+
+provider_registry: Mapping[str, type["Provider"]] = LazyRegistry(
+    {
+        "itau": provider_classes.paths["ItauProvider"],
+        "sistarbanc": provider_classes.paths["SistarbancProvider"],
+    }
+)
+
+# By account type
+transaction_model_registry: Mapping[str, type["BaseTransaction"]] = LazyRegistry(
+    {
+        "itau_bank_account": "tg_bank_forwarder.providers.itau:ItauAccountTransaction",
+        "itau_card_authorizations": "tg_bank_forwarder.providers.itau:ItauCardAuthorization",
+        "sistarbanc_movements": "tg_bank_forwarder.providers.sistarbanc:SistarbancMovement",
+        "sistarbanc_authorizations": "tg_bank_forwarder.providers.sistarbanc:SistarbancAuthorization",
+    }
+)
@@ -1,30 +1,82 @@
+from collections.abc import Iterator
 from datetime import datetime
+from io import BytesIO
 from os import environ
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, ClassVar, Literal
+from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup, Tag
-from pydantic import BaseModel
+from lxml import etree
 
-from .base import BaseProvider
+from ..fetch_state import fetch_state
+from ..session_store import SessionStore
+from .base import REQUEST_TIMEOUT, BaseProvider, BaseTransaction, SessionExpired
 
 if TYPE_CHECKING:
     from ..config import SistarbancAuthorizationsAccount, SistarbancMovementsAccount
 
+BASE_URL = "https://www.e-sistarbanc.com.uy/"
+
 DATE_FORMAT = "%d/%m/%y"
 DATETIME_FORMAT = f"{DATE_FORMAT} %H:%M:%S"
 
 
-def table_to_py(table: Tag):
-    output = []
-    for trs in table.select("tr"):
-        entry = []
-        tds = trs.select("td")
-        for td in tds:
-            entry.append(td.text.strip())
-        output.append(entry)
+SKIPPED_MOVEMENTS = {
+    "TOTAL TARJETA",
+    "SALDO AL ULTIMO CORTE",
+    "SALDO REGISTRADO A LA FECHA",
+}
+
+
+def iter_table_rows(html: str) -> Iterator[dict[str, str]]:
+    """Yields the rows of the `.maq_contenido.cuenta #listado table`, keyed by its first row
 
-    return [dict(zip(output[0], raw)) for raw in output[1:]]
+    The page is parsed as a stream, rows are dropped as soon as they are yielded
+    and parsing stops at the end of the table, or of `#listado` when it has none.
+    """
+    content = listado = table = None
+    header = None
+
+    for event, elem in etree.iterparse(
+        BytesIO(html.encode()), events=("start", "end"), html=True, encoding="utf-8"
+    ):
+        if event == "start":
+            if content is None:
+                if {"maq_contenido", "cuenta"} <= set(elem.get("class", "").split()):
+                    content = elem
+            elif listado is None:
+                if elem.get("id") == "listado":
+                    listado = elem
+            elif table is None and elem.tag == "table":
+                table = elem
+
+            continue
+
+        if elem is table:
+            return
+
+        # Tables after it aren't the listing, like in the content of an empty one
+        if elem is listado:
+            return
+
+        if elem is content:
+            return  # There's no table when there are no transactions
+
+        if content is None:
+            elem.clear()  # Nothing we need before the content
+        elif table is not None and elem.tag == "tr":
+            cells = [
+                etree.tostring(td, method="text", encoding=str, with_tail=False).strip()
+                for td in elem.iter("td")
+            ]
+            elem.clear()
+
+            if header is None:
+                header = cells
+            else:
+                yield dict(zip(header, cells))
+
+    assert content is not None, "Missing content"
 
 
 def parse_amount(amount_str: str):
@@ -49,7 +101,7 @@ def parse_amount_currency(uyu, usd):
     return amount, currency
 
 
-class SistarbancAuthorization(BaseModel):
+class SistarbancAuthorization(BaseTransaction):
     id: int  # What's this?
 
     card: str
@@ -80,34 +132,37 @@ class SistarbancAuthorization(BaseModel):
             currency=currency,
         )
 
-    def matches(self, other):
-        return all(
-            [
-                # self.id == other.id,
-                self.card == other.card,
-                self.date == other.date,
-                self.title == other.title,
-                self.amount == other.amount,
-                self.currency == other.currency,
-            ]
-        )
+    match_fields: ClassVar[tuple[str, ...]] = (
+        # "id",
+        "card",
+        "date",
+        "title",
+        "amount",
+        "currency",
+    )
+    bucket_fields: ClassVar[tuple[str, ...]] = ("card", "date", "amount", "currency")
+    similar_fields: ClassVar[tuple[str, ...]] = ("title",)
+    date_field = "date"
+
+    template = (
+        "<b>{title}{installments}</b>\n"
+        f"Date: {{date:{DATETIME_FORMAT}}}\n"
+        "\n"
+        "\n"
+        "<b>{currency}: {amount}</b>"
+    )
+    template_extras: ClassVar[tuple[str, ...]] = ("installments",)
 
-    def format(self):
-        installments = (
-            f"{self.instalments[0]}/{self.instalments[1]}"
-            if self.instalments[1] > 1
-            else None
-        )
-        text = f"<b>{self.title} {installments}</b>\n"
-        text += f"Date: {self.date.strftime(DATETIME_FORMAT)}\n"
-        text += "\n"
-        text += "\n"
-        text += f"<b>{self.currency}: {self.amount}</b>"
+    @classmethod
+    def template_values(cls, data: dict) -> dict:
+        number, count = data["instalments"]
+        # Nothing for purchases in a single installment
+        installments = f" {number}/{count}" if count > 1 else ""
 
-        return text
+        return {**data, "installments": installments}
 
 
-class SistarbancMovement(BaseModel):
+class SistarbancMovement(BaseTransaction):
     card: str
     ing: datetime
     title: str
@@ -132,52 +187,95 @@ class SistarbancMovement(BaseModel):
             amount=amount,
         )
 
-    def matches(self, other):
-        return all(
-            [
-                # self.id == other.id,
-                self.card == other.card,
-                self.ing == other.ing,
-                self.title == other.title,
-                self.amount == other.amount,
-                self.currency == other.currency,
-            ]
-        )
-
-    def format(self):
-        text = f"<b>{self.title}</b>\n"
-        text += f"Mov: {self.mov.strftime(DATE_FORMAT)}\n"
-        text += f"Ing: {self.ing.strftime(DATE_FORMAT)}\n"
-        text += "\n"
-        text += "\n"
-        text += f"<b>{self.currency}: {self.amount}</b>"
-
-        return text
+    match_fields: ClassVar[tuple[str, ...]] = (
+        # "id",
+        "card",
+        "ing",
+        "title",
+        "amount",
+        "currency",
+    )
+    # Movements only have a day, the same amount on the same day is more common
+    bucket_fields: ClassVar[tuple[str, ...]] = ("card", "ing", "amount", "currency")
+    similar_fields: ClassVar[tuple[str, ...]] = ("title",)
+    similarity_threshold: ClassVar[float] = 0.85
+    date_field = "ing"
+    windowed = True
+
+    template = (
+        "<b>{title}</b>\n"
+        f"Mov: {{mov:{DATE_FORMAT}}}\n"
+        f"Ing: {{ing:{DATE_FORMAT}}}\n"
+        "\n"
+        "\n"
+        "<b>{currency}: {amount}</b>"
+    )
 
 
 class SistarbancProvider(BaseProvider):
-    def __init__(self, credentials_env) -> None:
+    name = "sistarbanc"
+    endpoints = {
+        "sistarbanc_movements": "ac_movimientos_actuales.php",
+        "sistarbanc_authorizations": "ac_autorizaciones_pendientes.php",
+    }
+
+    def __init__(self, credentials_env, tenant="", base_url=BASE_URL) -> None:
+        self.base_url = base_url
         self.session = requests.Session()
+        # Pages already fetched on this session, accounts of the same type share them
+        self.responses: dict[str, requests.Response] = {}
         self.credentials_env = credentials_env
+        self.session_store = SessionStore(credentials_env, tenant)
 
     def __repr__(self):
         return f"<SistarbancProvider {self.credentials_env=}>"
 
     def __enter__(self):
-        username, password = environ[self.credentials_env].split(":")
-        self._login(username, password)
+        state = self.session_store.load()
+
+        if state:
+            for cookie in state["cookies"]:
+                self.session.cookies.set(**cookie)
+        else:
+            self.login()
 
         return self
 
     def __exit__(self, type, value, traceback):
+        if type is None:
+            self._save_session()
+
         self.session.close()
 
+    def _save_session(self):
+        self.session_store.save(
+            {
+                "cookies": [
+                    {
+                        "name": c.name,
+                        "value": c.value,
+                        "domain": c.domain,
+                        "path": c.path,
+                    }
+                    for c in self.session.cookies
+                ]
+            }
+        )
+
+    def login(self):
+        username, password = environ[self.credentials_env].split(":")
+        with self.timer("login"):
+            self._login(username, password)
+
+        self.logged_in = True
+        self._save_session()
+
     def _login(self, username, password):
         assert username and password, "Missing credentials."
 
-        self.session.get("https://www.e-sistarbanc.com.uy/ingresar/")
+        self.session.get(urljoin(self.base_url, "ingresar/"), timeout=REQUEST_TIMEOUT)
         self.session.post(
-            "https://www.e-sistarbanc.com.uy/ingresar/",
+            urljoin(self.base_url, "ingresar/"),
             data={
                 "email_acc": username,
                 "clave_acc": password,
@@ -185,52 +283,56 @@ class SistarbancProvider(BaseProvider):
             },
             headers={
                 "Content-Type": "application/x-www-form-urlencoded",
-                "Referer": "https://www.e-sistarbanc.com.uy/ingresar/",
+                "Referer": urljoin(self.base_url, "ingresar/"),
             },
+            timeout=REQUEST_TIMEOUT,
         )
 
-    def fetch_sistarbanc_movements(self, account: "SistarbancMovementsAccount"):
-        html = self.session.get(
-            "https://www.e-sistarbanc.com.uy/ac_movimientos_actuales.php"
-        ).text
-
-        bs = BeautifulSoup(html, "lxml")
+    def _get(self, url, account=None):
+        """Gets the page, raises Unchanged if it's the same the account processed last time"""
+        if url in self.responses:
+            res = self.responses[url]
+        else:
+            headers = (
+                fetch_state.request_headers(account.qualified_name, url)
+                if account
+                else {}
+            )
+            with self.timer("fetch", account):
+                res = self.session.get(
+                    urljoin(self.base_url, url),
+                    headers=headers,
+                    timeout=REQUEST_TIMEOUT,
+                )
+
+            # We got the login form instead of the page
+            if 'name="email_acc"' in res.text:
+                raise SessionExpired(f"Not logged in while fetching {url}")
+
+            if res.status_code == 200:
+                self.responses[url] = res
+
+        if account:
+            fetch_state.check(
+                account.qualified_name, url, res.status_code, res.headers, res.content
+            )
+
+        return res
 
-        content = bs.select_one(".maq_contenido.cuenta")
-        assert content, "Missing content"
-
-        table = content.select_one("#listado table")
-
-        if not table:
-            return []
+    def fetch_sistarbanc_movements(self, account: "SistarbancMovementsAccount"):
+        html = self.with_session(self._get, self.endpoint_for(account), account).text
 
-        data = table_to_py(table)
-        skiped_entries = [
-            "TOTAL TARJETA",
-            "SALDO AL ULTIMO CORTE",
-            "SALDO REGISTRADO A LA FECHA",
-        ]
-        return [
-            SistarbancMovement.parse_raw(e)
-            for e in data
-            if e["Concepto"] not in skiped_entries
-        ]
+        with self.timer("parse", account):
+            return [
+                SistarbancMovement.parse_raw(e)
+                for e in iter_table_rows(html)
+                if e["Concepto"] not in SKIPPED_MOVEMENTS
+            ]
 
     def fetch_sistarbanc_authorizations(
         self, account: "SistarbancAuthorizationsAccount"
     ):
-        html = self.session.get(
-            "https://www.e-sistarbanc.com.uy/ac_autorizaciones_pendientes.php"
-        ).text
-
-        bs = BeautifulSoup(html, "lxml")
-
-        content = bs.select_one(".maq_contenido.cuenta")
-        assert content, "Missing content"
-
-        table = content.select_one("#listado table")
-
-        if not table:
-            return []
+        html = self.with_session(self._get, self.endpoint_for(account), account).text
 
-        return [SistarbancAuthorization.parse_raw(e) for e in table_to_py(table)]
+        with self.timer("parse", account):
+            return [SistarbancAuthorization.parse_raw(e) for e in iter_table_rows(html)]
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from datetime import date
+from typing import TYPE_CHECKING, Any
+
+from pydantic_core import to_jsonable_python
+
+if TYPE_CHECKING:
+    from .providers.base import BaseTransaction
+
+
+def freeze(value: Any):
+    """Makes a value hashable, and equal whether it comes from a model or from its JSON"""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class TransactionRecord:
+    """A transaction as plain data along with its match key
+
+    Validating a model is slow, so models are only built when scraping, the
+    cache is loaded, diffed and stored as records.
+    """
+
+    __slots__ = ("model_class", "data", "key")
+
+    def __init__(self, model_class: type[BaseTransaction], data: dict):
+        self.model_class = model_class
+        self.data = data
+        self.key = model_class.match_key_from_data(data)
+
+    @classmethod
+    def from_model(cls, model: BaseTransaction):
+        return cls(type(model), model.model_dump())
+
+    def __repr__(self):
+        return f"<TransactionRecord {self.model_class.__name__} {self.key}>"
+
+    def __eq__(self, other):
+        if not isinstance(other, TransactionRecord):
+            return NotImplemented
+        return self.model_class is other.model_class and self.data == other.data
+
+    def match_key(self) -> tuple:
+        return self.key
+
+    def bucket_key(self) -> tuple | None:
+        return self.model_class.bucket_key_from_data(self.data)
+
+    def similarity(self, other: TransactionRecord) -> float:
+        return self.model_class.similarity_from_data(self.data, other.data)
+
+    @property
+    def similarity_threshold(self) -> float:
+        return self.model_class.similarity_threshold
+
+    def format(self) -> str:
+        return self.model_class.format_from_data(self.data)
+
+
+def record_encoder(obj):
+    if isinstance(obj, TransactionRecord):
+        return obj.data
+    return to_jsonable_python(obj)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .records import TransactionRecord, record_encoder
+from .transaction_cache import CACHE_DIR, mark_dirty, with_cache_dir
+
+if TYPE_CHECKING:
+    from .config import Account
+
+ARCHIVE_DIR = "archive"
+
+# Days of history kept on the working set, by account type. Types without one keep
+# everything the bank returns, and nothing else, like before
+retention_windows: dict[str, int] = {}
+
+logger = logging.getLogger(__name__)
+
+
+def configure_retention(windows: dict[str, int]):
+    global retention_windows
+    retention_windows = windows
+
+
+def archive_filename(account: Account, month: str) -> str:
+    return str(Path(ARCHIVE_DIR, account.qualified_name, f"{month}.jsonl.gz"))
+
+
+def load_archive(account: Account, month: str) -> list[TransactionRecord]:
+    """The archived transactions of the account for a month, as YYYY-MM"""
+    try:
+        with gzip.open(Path(CACHE_DIR, archive_filename(account, month)), "rt") as f:
+            return [
+                TransactionRecord(account.transaction_model, json.loads(line))
+                for line in f
+            ]
+    except FileNotFoundError:
+        return []
+
+
+@with_cache_dir
+def archive_transactions(account: Account, transactions: list[TransactionRecord]):
+    """Appends the transactions to their month's archive, unless they're already there"""
+    by_month: defaultdict[str, list[TransactionRecord]] = defaultdict(list)
+    for t in transactions:
+        by_month[t.model_class.day_from_data(t.data)[:7]].append(t)
+
+    for month, month_transactions in sorted(by_month.items()):
+        archived = Counter(t.match_key() for t in load_archive(account, month))
+        lines = []
+
+        for t in month_transactions:
+            if archived[t.match_key()]:
+                archived[t.match_key()] -= 1
+            else:
+                lines.append(json.dumps(t, default=record_encoder) + "\n")
+
+        if not lines:
+            continue
+
+        filename = archive_filename(account, month)
+        path = Path(CACHE_DIR, filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        mark_dirty(filename)
+
+        # Each append is a new gzip member, readers go through all of them
+        with open(path, "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                gz.write("".join(lines).encode())
+
+
+def apply_retention(
+    account: Account,
+    current: list[TransactionRecord],
+    diff: dict[str, list[TransactionRecord]],
+    today: date | None = None,
+) -> list[TransactionRecord]:
+    """Returns the working set to store, archiving what fell out of the window
+
+    Statements only show recent transactions, Itau only the current month, so on
+    windowed models cached ones disappearing from before the oldest one shown
+    weren't deleted, they just aren't shown anymore. They are kept while in the
+    window, archived past it, and never reported as deletions. Authorizations
+    list whatever is pending, anything gone from them was deleted. New
+    transactions from before the window are looked up on the archive, so nothing
+    is sent twice if they show up again.
+
+    `diff` is updated in place.
+    """
+    window = retention_windows.get(account.type)
+    if window is None:
+        return current
+
+    model = account.transaction_model
+    cutoff = ((today or date.today()) - timedelta(days=window)).isoformat()
+
+    def day(t: TransactionRecord) -> str:
+        return model.day_from_data(t.data)
+
+    # Everything is out of view when the bank shows nothing, like on the 1st
+    shown_from = min((day(t) for t in current), default=None)
+
+    deletions, kept, aged_out = [], [], []
+    for t in diff["-"]:
+        if not model.windowed or (shown_from is not None and day(t) >= shown_from):
+            deletions.append(t)
+        elif day(t) >= cutoff:
+            kept.append(t)
+        else:
+            aged_out.append(t)
+
+    additions, found = [], []
+    archives: dict[str, Counter] = {}
+    for t in diff["+"]:
+        if day(t) < cutoff:
+            month = day(t)[:7]
+            if month not in archives:
+                archives[month] = Counter(
+                    a.match_key() for a in load_archive(account, month)
+                )
+
+            if archives[month][t.match_key()]:
+                archives[month][t.match_key()] -= 1
+                found.append(t)
+                continue
+
+        additions.append(t)
+
+    if aged_out:
+        archive_transactions(account, aged_out)
+
+    if kept or aged_out or found:
+        logger.info(
+            f"{account.qualified_name}: kept {len(kept)} no longer shown,"
+            f" archived {len(aged_out)}, {len(found)} found on the archive"
+        )
+
+    diff["-"] = deletions
+    diff["="] = diff["="] + found
+    diff["+"] = additions
+
+    return current + kept
@@ -0,0 +1,113 @@
+import heapq
+import logging
+import random
+import signal
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(order=True)
+class Job:
+    next_run: float
+    name: str = field(compare=False)
+    # Fixed, or worked out again after every run
+    interval: float | Callable[[], float] = field(compare=False)
+    jitter: float = field(compare=False)
+    # May return how long to wait before running again, instead of the interval
+    func: Callable[[], float | None] = field(compare=False)
+
+    def reschedule(self, now: float, delay: float | None = None):
+        if delay is None:
+            interval = self.interval() if callable(self.interval) else self.interval
+            delay = interval + random.uniform(0, self.jitter)
+
+        self.next_run = now + delay
+
+
+class Scheduler:
+    """Runs jobs on their own interval inside a single long-lived process"""
+
+    def __init__(self, executor: Executor | None = None):
+        self.jobs: list[Job] = []
+        self.stop_event = threading.Event()
+        # Jobs run concurrently on the executor, which is left running for whoever
+        # passed it. A job is off the heap while it runs, so it never overlaps itself
+        self.executor = executor
+        self.running = 0
+        self.lock = threading.Lock()
+        # Set when a job finishes, so it's scheduled again without waiting for the others
+        self.wakeup = threading.Event()
+
+    def every(
+        self,
+        interval: float | Callable[[], float],
+        func: Callable[[], float | None],
+        jitter=0.0,
+        name="",
+    ):
+        job = Job(time.monotonic(), name, interval, jitter, func)
+        heapq.heappush(self.jobs, job)
+        return job
+
+    def stop(self, *args):
+        logger.info("Stopping scheduler")
+        self.stop_event.set()
+        self.wakeup.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def run_job(self, job: Job) -> float | None:
+        logger.debug(f"Running {job.name}")
+        try:
+            return job.func()
+        except Exception:
+            logger.exception(f"Job {job.name} failed")
+            return None
+
+    def job_done(self, job: Job, delay: float | None):
+        with self.lock:
+            job.reschedule(time.monotonic(), delay)
+            heapq.heappush(self.jobs, job)
+            self.running -= 1
+
+        self.wakeup.set()
+
+    def start_job(self, job: Job):
+        if not self.executor:
+            self.job_done(job, self.run_job(job))
+            return
+
+        future = self.executor.submit(self.run_job, job)
+        future.add_done_callback(lambda f: self.job_done(job, f.result()))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            due = []
+            with self.lock:
+                while self.jobs and self.jobs[0].next_run <= time.monotonic():
+                    due.append(heapq.heappop(self.jobs))
+                self.running += len(due)
+
+            for job in due:
+                self.start_job(job)
+
+            with self.lock:
+                if not self.jobs and not self.running:
+                    break
+                # Only a finishing job can wake us up when they are all running
+                timeout = (
+                    max(0, self.jobs[0].next_run - time.monotonic())
+                    if self.jobs
+                    else None
+                )
+
+            # Returns early when a job finishes, or if we are asked to stop
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
@@ -0,0 +1,37 @@
+import json
+import os
+from pathlib import Path
+
+SESSION_DIR = Path("state", "sessions")
+
+
+class SessionStore:
+    """Persists the authenticated session of a set of credentials between runs
+
+    Sessions are as good as the credentials themselves, so they are only readable by the owner.
+    Tenants don't share sessions, even with the same credentials, so each has its own directory.
+    """
+
+    def __init__(self, credentials_env: str, tenant: str = ""):
+        self.path = SESSION_DIR / tenant / f"{credentials_env}.json"
+
+    def load(self) -> dict | None:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, state: dict):
+        SESSION_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.path.parent.mkdir(mode=0o700, exist_ok=True)
+
+        tmp_path = self.path.with_suffix(".tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import html
+from collections.abc import Iterable
+from datetime import date, datetime
+from functools import lru_cache
+from string import Formatter
+from types import UnionType
+from typing import TYPE_CHECKING, Any, Literal, Union, get_args, get_origin
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+    from .config import Account
+    from .records import TransactionRecord
+
+DEFAULT_HEADER_TEMPLATE = "<u>{name}</u>\n\n"
+
+# Templates by account type, overriding the default of each transaction model
+templates_by_type: dict[str, str] = {}
+header_template = DEFAULT_HEADER_TEMPLATE
+
+# By qualified account name, accounts don't change while running
+account_templates: dict[str, CompiledTemplate] = {}
+account_headers: dict[str, str] = {}
+
+
+def configure_templates(templates: dict[str, str], header: str):
+    global templates_by_type, header_template
+    templates_by_type = templates
+    header_template = header
+    account_templates.clear()
+    account_headers.clear()
+
+
+# What format specs are tried on when checking templates, by field type
+SAMPLE_VALUES = {
+    str: "",
+    int: 0,
+    float: 0.0,
+    bool: False,
+    date: date(2000, 1, 1),
+    datetime: datetime(2000, 1, 1),
+}
+
+
+@lru_cache(maxsize=8192, typed=True)
+def _render_value(value: Any, spec: str) -> str:
+    if not isinstance(value, str):
+        # Numbers and dates have nothing to escape
+        return format(value, spec)
+
+    return html.escape(format(value, spec), quote=False)
+
+
+def render_value(value: Any, spec: str = "") -> str:
+    """Formats and escapes a value, same values repeat a lot so they're cached"""
+    try:
+        return _render_value(value, spec)
+    except TypeError:  # Unhashable, like lists
+        return _render_value.__wrapped__(value, spec)
+
+
+class CompiledTemplate:
+    """A str.format template parsed once, rendered with a single join
+
+    The template itself is HTML, the values are escaped. Fields can have a
+    format spec, like `{date:%d/%m/%y}`, but no attributes, indexes or conversions.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parts: list[str] = []
+        # Index on parts, field name and format spec
+        self.fields: list[tuple[int, str, str]] = []
+
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if literal:
+                self.parts.append(literal)
+
+            if field is None:
+                continue
+            if not field.isidentifier() or conversion:
+                raise ValueError(f"Unsupported field {{{field}}} in {template!r}")
+
+            self.fields.append((len(self.parts), field, spec or ""))
+            self.parts.append("")
+
+    def __repr__(self):
+        return f"<CompiledTemplate {self.template!r}>"
+
+    def render(self, values: dict) -> str:
+        parts = self.parts.copy()
+        for index, field, spec in self.fields:
+            parts[index] = render_value(values[field], spec)
+
+        return "".join(parts)
+
+
+@lru_cache(maxsize=None)
+def compile_template(template: str) -> CompiledTemplate:
+    return CompiledTemplate(template)
+
+
+def sample_value(annotation: Any) -> Any:
+    if annotation in SAMPLE_VALUES:
+        return SAMPLE_VALUES[annotation]
+
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin is Literal:
+        return args[0]
+    if origin in (Union, UnionType):
+        return sample_value(args[0])
+    if origin is tuple:
+        return tuple(sample_value(arg) for arg in args)
+
+    return ""
+
+
+def check_template(
+    template: str, model: type[BaseModel], extras: Iterable[str] = ()
+) -> str:
+    """Checks the fields and format specs of a template against what it's rendered with
+
+    Templates on the config are checked when it's read, a template that fails to
+    render would fail every poll of its accounts.
+    """
+    compiled = compile_template(template)
+
+    for _, field, spec in compiled.fields:
+        if field in extras:
+            sample = ""
+        elif field in model.model_fields:
+            sample = sample_value(model.model_fields[field].annotation)
+        else:
+            fields = ", ".join([*model.model_fields, *extras])
+            raise ValueError(
+                f"Unknown field {{{field}}} in {template!r}, it can be one of {fields}"
+            )
+
+        try:
+            render_value(sample, spec)
+        except (ValueError, TypeError) as err:
+            raise ValueError(
+                f"Invalid format {{{field}:{spec}}} in {template!r}: {err}"
+            ) from err
+
+    return template
+
+
+def template_for(account: Account) -> CompiledTemplate:
+    name = account.qualified_name
+    if name not in account_templates:
+        account_templates[name] = compile_template(
+            account.template
+            or templates_by_type.get(account.type)
+            or account.transaction_model.template
+        )
+
+    return account_templates[name]
+
+
+def render_header(account: Account) -> str:
+    name = account.qualified_name
+    if name not in account_headers:
+        account_headers[name] = compile_template(header_template).render(
+            account.model_dump()
+        )
+
+    return account_headers[name]
+
+
+def render_transactions(
+    account: Account, transactions: list[TransactionRecord]
+) -> list[str]:
+    template = template_for(account)
+    return [
+        template.render(t.model_class.template_values(t.data)) for t in transactions
+    ]
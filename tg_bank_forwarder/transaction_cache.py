@@ -1,7 +1,11 @@
 from __future__ import annotations
 
 import json
+import logging
 import os
+import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 from functools import wraps
 from pathlib import Path
@@ -10,54 +14,283 @@ from typing import TYPE_CHECKING
 from dulwich.errors import NotGitRepository
 from dulwich.porcelain import get_tree_changes
 from dulwich.repo import Repo
-from pydantic import BaseModel, parse_file_as
-from pydantic.json import pydantic_encoder
+
+from .metrics import metrics
+from .records import TransactionRecord, record_encoder
 
 if TYPE_CHECKING:
     from .config import Account
 
 CACHE_DIR = "cache"
 
+# Providers might run concurrently, every read or write to the cache should hold this
+cache_lock = threading.RLock()
 
-def load_transactions(account: Account):
-    try:
-        return parse_file_as(
-            list[account.transaction_model], Path(CACHE_DIR, f"{account.name}.json")
-        )
-    except FileNotFoundError:
-        return []
+# Cache files written since the last commit, one per line, so only those get
+# staged. Kept on disk so what was written before a crash is committed later
+DIRTY_FILES = Path("state", "cache_dirty_files")
+
+# Commit at most this often, in seconds. Changes in between stay staged
+commit_interval = 0
+# Loose objects are packed once there are more than this
+max_loose_objects = 500
+
+logger = logging.getLogger(__name__)
 
 
 def with_cache_dir(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
-        func(*args, **kwargs)
+        return func(*args, **kwargs)
 
     return wrapper
 
 
+def mark_dirty(filename: str):
+    """Remembers a cache file for the next commit, call it before writing the file"""
+    DIRTY_FILES.parent.mkdir(parents=True, exist_ok=True)
+    with cache_lock, open(DIRTY_FILES, "a") as f:
+        f.write(filename + "\n")
+
+
+def dirty_files() -> set[str]:
+    try:
+        return set(DIRTY_FILES.read_text().splitlines())
+    except FileNotFoundError:
+        return set()
+
+
 @with_cache_dir
-def store_transactions(account: Account, transactions: list[BaseModel]):
+def write_cache_file(filename: str, content: str):
+    """Writes the file only if its content changed, so it isn't staged for nothing"""
+    path = Path(CACHE_DIR, filename)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if path.read_text() == content:
+            return
+    except FileNotFoundError:
+        pass
+
+    mark_dirty(filename)
+    path.write_text(content)
+
+
+def check_transactions(account: Account, transactions: list[TransactionRecord]):
     for t in transactions:
-        assert isinstance(
-            t, account.transaction_model
-        ), f"Tried to store invalid transaction type for {account.name}. {t.__class__} != {account.transaction_model}"
+        assert (
+            t.model_class is account.transaction_model
+        ), f"Tried to store invalid transaction type for {account.name}. {t.model_class} != {account.transaction_model}"
 
-    with open(Path(CACHE_DIR, f"{account.name}.json"), "w") as f:
-        f.write(json.dumps(transactions, indent=4, default=pydantic_encoder))
 
+class JSONStorage:
+    """One pretty printed file per account, plus the last diff next to it"""
 
-@with_cache_dir
-def store_diff(account, diff):
-    Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
-    with open(Path(CACHE_DIR, f"{account.name}-diff.json"), "w") as f:
-        f.write(json.dumps(diff, indent=4, default=pydantic_encoder))
+    def load(self, account: Account):
+        try:
+            with open(Path(CACHE_DIR, f"{account.qualified_name}.json")) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+
+        return [TransactionRecord(account.transaction_model, d) for d in data]
+
+    def store(self, account: Account, transactions: list[TransactionRecord]):
+        check_transactions(account, transactions)
+
+        write_cache_file(
+            f"{account.qualified_name}.json",
+            json.dumps(transactions, indent=4, default=record_encoder),
+        )
+
+    def store_diff(self, account: Account, diff):
+        write_cache_file(
+            f"{account.qualified_name}-diff.json",
+            json.dumps(diff, indent=4, default=record_encoder),
+        )
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    match_key TEXT NOT NULL,
+    occurrence INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (account, match_key, occurrence)
+);
+CREATE TABLE IF NOT EXISTS diffs (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    match_key TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS diffs_account ON diffs (account, created_at);
+CREATE TABLE IF NOT EXISTS migrations (
+    account TEXT PRIMARY KEY,
+    migrated_at REAL NOT NULL
+);
+"""
+
+
+def match_key_text(transaction: TransactionRecord) -> str:
+    return json.dumps(transaction.key)
+
+
+def data_text(transaction: TransactionRecord) -> str:
+    return json.dumps(transaction.data, default=record_encoder)
+
+
+class SQLiteStorage:
+    """Every account on a single database, indexed by match key
+
+    Only the rows that changed are written, and additions and deletions are
+    kept as a history instead of overwriting the last diff.
+    """
+
+    def __init__(self, path=Path(CACHE_DIR, "transactions.sqlite3")):
+        self.path = path
+        self._db = None
+        # Nested transactions go along with the outermost one
+        self._transaction_depth = 0
+
+    @property
+    @with_cache_dir
+    def db(self):
+        if not self._db:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(SQLITE_SCHEMA)
+
+        return self._db
+
+    @contextmanager
+    def transaction(self):
+        """Commits at the end, unless it's inside another one, or rolls back on errors"""
+        self._transaction_depth += 1
+        try:
+            if self._transaction_depth > 1:
+                yield
+            else:
+                with self.db:
+                    yield
+        finally:
+            self._transaction_depth -= 1
+
+    def load(self, account: Account):
+        rows = self.db.execute(
+            "SELECT data FROM transactions WHERE account = ? ORDER BY position",
+            (account.qualified_name,),
+        )
+
+        return [
+            TransactionRecord(account.transaction_model, json.loads(data))
+            for (data,) in rows
+        ]
+
+    def store(self, account: Account, transactions: list[TransactionRecord]):
+        check_transactions(account, transactions)
+
+        occurrences: dict[str, int] = {}
+        rows = []
+        for position, t in enumerate(transactions):
+            key = match_key_text(t)
+            occurrences[key] = occurrences.get(key, 0) + 1
+            rows.append(
+                (account.qualified_name, key, occurrences[key], position, data_text(t))
+            )
+
+        with self.transaction():
+            existing = set(
+                self.db.execute(
+                    "SELECT match_key, occurrence FROM transactions WHERE account = ?",
+                    (account.qualified_name,),
+                )
+            )
+            removed = existing - {(key, occurrence) for _, key, occurrence, *_ in rows}
+
+            self.db.executemany(
+                "DELETE FROM transactions WHERE account = ? AND match_key = ? AND occurrence = ?",
+                [(account.qualified_name, *key) for key in removed],
+            )
+            self.db.executemany(
+                "INSERT INTO transactions (account, match_key, occurrence, position, data)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (account, match_key, occurrence) DO UPDATE SET position = excluded.position, data = excluded.data"
+                " WHERE position != excluded.position OR data != excluded.data",
+                rows,
+            )
+
+    def store_diff(self, account: Account, diff, created_at=None):
+        # Matches are left out, otherwise every run would copy the whole account
+        created_at = created_at or time.time()
+        rows = [
+            (account.qualified_name, created_at, kind, match_key_text(t), data_text(t))
+            for kind in ["-", "~", "+"]
+            for t in diff[kind]
+        ]
+
+        with self.transaction():
+            self.db.executemany(
+                "INSERT INTO diffs (account, created_at, kind, match_key, data)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+storage_backends = {
+    "json": JSONStorage,
+    "sqlite": SQLiteStorage,
+}
+
+storage: JSONStorage | SQLiteStorage = JSONStorage()
+
+
+def configure_storage(backend: str):
+    global storage
+    storage = storage_backends[backend]()
 
 
-def repo_has_staged_changes(repo: Repo):
+def load_transactions(account: Account):
+    return storage.load(account)
+
+
+def store_transactions(account: Account, transactions: list[TransactionRecord]):
+    storage.store(account, transactions)
+
+
+def store_diff(account: Account, diff):
+    storage.store_diff(account, diff)
+
+
+def staged_changes(repo: Repo) -> list[bytes]:
     changes = get_tree_changes(repo)
-    return any(len(changes[key]) > 0 for key in ["add", "delete", "modify"])
+    return [path for key in ["add", "delete", "modify"] for path in changes[key]]
+
+
+def configure_commits(interval: int = 0, loose_objects: int = 500):
+    global commit_interval, max_loose_objects
+    commit_interval = interval
+    max_loose_objects = loose_objects
+
+
+def count_loose_objects(repo: Repo) -> int:
+    objects_dir = Path(repo.object_store.path)
+    return sum(
+        len(os.listdir(d))
+        for d in objects_dir.iterdir()
+        if len(d.name) == 2 and d.is_dir()
+    )
+
+
+def commit_is_due(repo: Repo):
+    try:
+        last_commit = repo[repo.head()].commit_time
+    except KeyError:
+        return True  # No commits yet
+
+    return time.time() - last_commit >= commit_interval
 
 
 @contextmanager
@@ -65,16 +298,39 @@ def commit_cache_changes():
     try:
         r = Repo(CACHE_DIR)
     except NotGitRepository:
+        Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
         r = Repo.init(CACHE_DIR)
     try:
         yield
     finally:
-        r.stage([f for f in os.listdir(CACHE_DIR) if f.endswith(".json")])
+        with cache_lock:
+            start = time.perf_counter()
+            dirty = dirty_files()
+            with metrics.timer("git_stage"):
+                r.stage(sorted(dirty))
+            logger.info(f"Staged cache changes in {time.perf_counter() - start:.3f}s")
 
-        if repo_has_staged_changes(r):
-            r.do_commit(
-                message=b"Update",
-                author=b"tg_bank_forwarder <>",
-            )
+            # Diffs change on every run, they are only worth a commit along with the cache
+            changes = [p for p in staged_changes(r) if not p.endswith(b"-diff.json")]
+
+            if changes and commit_is_due(r):
+                start = time.perf_counter()
+                with metrics.timer("git_commit"):
+                    r.do_commit(
+                        message=b"Update",
+                        author=b"tg_bank_forwarder <>",
+                    )
+                logger.info(f"Committed cache in {time.perf_counter() - start:.3f}s")
+                DIRTY_FILES.unlink(missing_ok=True)
+
+                if count_loose_objects(r) > max_loose_objects:
+                    start = time.perf_counter()
+                    r.object_store.pack_loose_objects()
+                    logger.info(
+                        f"Packed cache objects in {time.perf_counter() - start:.3f}s"
+                    )
+            elif dirty:
+                # Staged until the next commit, only once each
+                DIRTY_FILES.write_text("".join(f"{name}\n" for name in sorted(dirty)))
 
             r.close()
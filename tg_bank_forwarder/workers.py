@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from dataclasses import dataclass, field
+
+from .browser import configure_browser_pool, process_tree_rss
+from .fetch_state import Unchanged, fetch_state
+from .metrics import metrics
+from .planner import Session
+from .providers.registry import provider_registry
+from .records import TransactionRecord
+from .retention import configure_retention
+from .templates import DEFAULT_HEADER_TEMPLATE, configure_templates
+
+logger = logging.getLogger(__name__)
+
+# Workers start from scratch, nothing the parent holds (threads, sockets, the
+# cache) leaks into them
+mp_context = multiprocessing.get_context("spawn")
+
+# How often a running worker is checked against its limits, in seconds
+POLL_INTERVAL = 0.5
+
+
+class WorkerError(Exception):
+    """A worker failed, or was killed after running out of retries"""
+
+
+@dataclass
+class WorkerLimits:
+    timeout: float = 300
+    max_rss_mb: int | None = None
+    retries: int = 1
+
+
+@dataclass
+class WorkerSettings:
+    """What the parent configures its modules with, workers start without it"""
+
+    browser_max_uses: int = 20
+    browser_max_rss_mb: int | None = None
+    retention: dict[str, int] = field(default_factory=dict)
+    templates: dict[str, str] = field(default_factory=dict)
+    header_template: str = DEFAULT_HEADER_TEMPLATE
+
+    def configure(self):
+        configure_browser_pool(self.browser_max_uses, self.browser_max_rss_mb)
+        configure_retention(self.retention)
+        configure_templates(self.templates, self.header_template)
+
+
+@dataclass
+class WorkerResult:
+    # Transactions data by qualified account name, None when unchanged
+    transactions: dict[str, list[dict] | None] = field(default_factory=dict)
+    # Fetch state to commit along with each account
+    fetch_state: dict[str, dict] = field(default_factory=dict)
+    metrics: tuple[dict, dict] = ({}, {})
+    # Whether it had to log in, as opposed to reusing a saved session
+    logged_in: bool = False
+    # Set when the provider failed half way, accounts before it are still there
+    error: str | None = None
+
+
+def fetch_session(session: Session, provider_options: dict) -> WorkerResult:
+    """Runs on the worker, fetches the accounts of the session without touching the cache"""
+    result = WorkerResult()
+    provider = provider_registry[session.provider](
+        session.credentials_env, tenant=session.tenant, **provider_options
+    )
+
+    try:
+        with provider:
+            for account in session.accounts:
+                name = account.qualified_name
+
+                try:
+                    records = provider.fetch_records(account)
+                    result.transactions[name] = [t.data for t in records]
+                except Unchanged:
+                    result.transactions[name] = None
+
+                result.fetch_state[name] = fetch_state.take_pending(name)
+    except Exception as err:
+        logger.exception(f"Worker for {session.name} failed")
+        result.error = f"{type(err).__name__}: {err}"
+
+    result.logged_in = provider.logged_in
+    result.metrics = metrics.snapshot()
+
+    return result
+
+
+def worker_main(
+    conn,
+    session: Session,
+    provider_options: dict,
+    settings: WorkerSettings,
+    log_level: int,
+):
+    # Its own process group, so the browsers it starts are killed along with it
+    os.setsid()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=log_level
+    )
+    settings.configure()
+
+    conn.send(fetch_session(session, provider_options))
+    conn.close()
+
+
+def kill_worker(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.join()
+
+
+def run_worker(
+    session: Session,
+    provider_options: dict,
+    limits: WorkerLimits,
+    settings: WorkerSettings,
+):
+    """Fetches the session on a worker process, retrying if it hangs, bloats or dies"""
+    for attempt in range(1, limits.retries + 2):
+        receiver, sender = mp_context.Pipe(duplex=False)
+        process = mp_context.Process(
+            target=worker_main,
+            args=(
+                sender,
+                session,
+                provider_options,
+                settings,
+                logger.getEffectiveLevel(),
+            ),
+            name=f"worker {session.name}",
+        )
+        process.start()
+        sender.close()
+
+        deadline = time.monotonic() + limits.timeout
+        reason = None
+
+        while reason is None:
+            if receiver.poll(POLL_INTERVAL):
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    reason = "died"
+                    continue
+
+                # Whatever it left behind goes with it
+                process.join(POLL_INTERVAL * 10)
+                kill_worker(process)
+                return result
+
+            if not process.is_alive():
+                reason = f"died with exit code {process.exitcode}"
+            elif time.monotonic() > deadline:
+                reason = f"timed out after {limits.timeout}s"
+            elif limits.max_rss_mb is not None:
+                rss = process_tree_rss(process.pid, include_self=True) / 2**20
+                if rss > limits.max_rss_mb:
+                    reason = f"went over {limits.max_rss_mb}MB with {rss:.0f}MB"
+
+        kill_worker(process)
+        receiver.close()
+
+        metrics.inc("worker_failures", provider=session.provider, tenant=session.tenant)
+        logger.warning(f"Worker for {session.name} {reason} (attempt {attempt})")
+
+    raise WorkerError(f"Worker for {session.name} {reason}, giving up")
+
+
+def check_in_worker(
+    session: Session,
+    provider_options: dict,
+    limits: WorkerLimits,
+    settings: WorkerSettings,
+    on_diff=None,
+    policy=None,
+) -> int:
+    """Like checking the session in process, but the scraping happens on a worker
+
+    Only this process touches the cache and its repository. Returns how many
+    accounts were skipped because they didn't change. The adaptive `policy`, if
+    any, learns from every account that was checked.
+    """
+    result = run_worker(session, provider_options, limits, settings)
+    metrics.merge(*result.metrics)
+
+    if policy:
+        policy.record_login(session, result.logged_in)
+
+    provider_class = provider_registry[session.provider]
+    unchanged = 0
+
+    for account in session.accounts:
+        name = account.qualified_name
+        if name not in result.transactions:
+            continue  # The worker failed before getting to it
+
+        fetch_state.add_pending(name, result.fetch_state.get(name, {}))
+        data = result.transactions[name]
+
+        if data is None:
+            provider_class.count_unchanged(account)
+            unchanged += 1
+            diff = None
+        else:
+            records = [TransactionRecord(account.transaction_model, d) for d in data]
+            diff = provider_class.reconcile(account, records, on_diff)
+
+        if policy:
+            policy.checked(account, diff)
+
+    if result.error:
+        raise WorkerError(result.error)
+
+    return unchanged